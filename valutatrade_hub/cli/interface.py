@@ -1,11 +1,14 @@
 # valutatrade_hub/cli/interface.py
 import argparse
+import json
+import shlex
 import sys
 from decimal import Decimal
 
 from prettytable import PrettyTable
 
 from ..core import usecases
+from ..core.currencies import FiatCurrency
 
 # Импортируем измененные исключения
 from ..core.exceptions import (
@@ -16,6 +19,7 @@ from ..core.exceptions import (
     UserNotFoundError,
     ValidationError,
 )
+from ..core.valuation import valuation_cache
 from ..infra.database import database_manager
 from ..logging_config import configure_logging 
 from ..parser_service.updater import updater
@@ -46,6 +50,8 @@ class CLIInterface:
                                                            help="Показать портфель пользователя")
         show_portfolio_parser.add_argument("--base", default="USD",
                                            help="Базовая валюта для расчета общей стоимости (по умолчанию USD)")
+        show_portfolio_parser.add_argument("--at",
+                                           help="Оценить по курсам на момент времени UTC (например, 2026-09-01T12:00)")
         show_portfolio_parser.set_defaults(func=self.handle_show_portfolio)
 
         buy_parser = self.subparsers.add_parser("buy", help="Купить валюту")
@@ -66,7 +72,7 @@ class CLIInterface:
         # update-rates
         update_rates_parser = self.subparsers.add_parser("update-rates",
                                                          help="Запустить немедленное обновление курсов валют")
-        update_rates_parser.add_argument("--source", choices=['coingecko', 'exchangerate'],
+        update_rates_parser.add_argument("--source", choices=updater.provider_names(),
                                          help="Обновить данные только из указанного источника")
         update_rates_parser.set_defaults(func=self.handle_update_rates)
 
@@ -78,6 +84,55 @@ class CLIInterface:
         show_rates_parser.add_argument("--base", default="USD", help="Базовая валюта для отображения курсов")
         show_rates_parser.set_defaults(func=self.handle_show_rates)
 
+        # execute-batch
+        batch_parser = self.subparsers.add_parser("execute-batch",
+                                                  help="Исполнить пакет заявок buy/sell из JSON-файла")
+        batch_parser.add_argument("--file", required=True,
+                                  help='JSON-список заявок: [{"user_id", "action", "currency", "amount"}, ...]')
+        batch_parser.set_defaults(func=self.handle_execute_batch)
+
+        # valuate-all
+        valuate_parser = self.subparsers.add_parser("valuate-all",
+                                                    help="Оценить все портфели и экспозицию по валютам")
+        valuate_parser.add_argument("--base", default="USD",
+                                    help="Базовые валюты через запятую (например, USD,EUR)")
+        valuate_parser.add_argument("--output", help="Сохранить полный отчет в JSON-файл")
+        valuate_parser.add_argument("--at", help="Оценить по курсам на момент времени UTC (например, 2026-08-31T23:59)")
+        valuate_parser.set_defaults(func=self.handle_valuate_all)
+
+        # show-candles
+        candles_parser = self.subparsers.add_parser("show-candles", help="Показать OHLC-свечи по паре")
+        candles_parser.add_argument("--pair", required=True, help="Пара, например BTC_USD")
+        candles_parser.add_argument("--interval", default="1h", choices=["1m", "1h", "1d"], help="Интервал свечи")
+        candles_parser.add_argument("--from", dest="start", help="Начало периода UTC (ISO)")
+        candles_parser.add_argument("--to", dest="end", help="Конец периода UTC (ISO)")
+        candles_parser.add_argument("--limit", type=int, default=50, help="Показать не больше N последних свечей")
+        candles_parser.set_defaults(func=self.handle_show_candles)
+
+        # search-currency
+        search_parser = self.subparsers.add_parser("search-currency",
+                                                   help="Найти валюту по коду или названию")
+        search_parser.add_argument("--query", required=True, help="Код, начало кода или часть названия")
+        search_parser.add_argument("--limit", type=int, default=10, help="Показать не больше N валют")
+        search_parser.set_defaults(func=self.handle_search_currency)
+
+        # rebuild-rate-history
+        rebuild_parser = self.subparsers.add_parser("rebuild-rate-history",
+                                                    help="Пересобрать индекс истории курсов "
+                                                         "из exchange_rates.json и сегментов")
+        rebuild_parser.set_defaults(func=self.handle_rebuild_rate_history)
+
+        # migrate-to-sqlite
+        migrate_parser = self.subparsers.add_parser("migrate-to-sqlite",
+                                                    help="Перенести данные из data/*.json в SQLite")
+        migrate_parser.set_defaults(func=self.handle_migrate_to_sqlite)
+
+        # reshard-portfolios
+        reshard_parser = self.subparsers.add_parser("reshard-portfolios",
+                                                    help="Изменить число шардов портфелей (portfolio_layout = sharded)")
+        reshard_parser.add_argument("--shards", type=int, required=True, help="Новое число шардов")
+        reshard_parser.set_defaults(func=self.handle_reshard_portfolios)
+
     def handle_register(self, args):
         try:
             user_id = usecases.register_user(args.username, args.password)
@@ -105,7 +160,8 @@ class CLIInterface:
             return
 
         try:
-            portfolio_data, total_value = usecases.show_portfolio(self.user_id, args.base.upper())
+            portfolio_data, total_value = usecases.show_portfolio(self.user_id, args.base.upper(),
+                                                                  at=getattr(args, 'at', None))
 
             table = PrettyTable()
             table.field_names = ["Валюта", "Баланс", f"Стоимость ({args.base.upper()})"]
@@ -120,7 +176,8 @@ class CLIInterface:
                     # Форматирование выводим в CLI
                     table.add_row([currency, f"{data['balance']:.4f}", f"{data['value_in_base']:.2f}"])
 
-            print(f"Портфель пользователя '{self.username}' (база: {args.base.upper()}):")
+            at_note = f", курсы на {args.at}" if getattr(args, 'at', None) else ""
+            print(f"Портфель пользователя '{self.username}' (база: {args.base.upper()}{at_note}):")
             print(table)
             print("-" * 40)
             print(f"ИТОГО: {total_value:.2f} {args.base.upper()}")
@@ -238,96 +295,194 @@ class CLIInterface:
         except Exception as e:
             print(f"Ошибка при отображении курсов: {e}")
 
+    def handle_execute_batch(self, args):
+        try:
+            with open(args.file, "r", encoding="utf-8") as f:
+                orders = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ошибка: не удалось прочитать файл заявок: {e}")
+            return
+        if not isinstance(orders, list):
+            print("Ошибка: файл заявок должен содержать JSON-список.")
+            return
+
+        results = usecases.execute_batch(orders)
+        failed = [r for r in results if r['status'] != "OK"]
+        print(f"Исполнено заявок: {len(results) - len(failed)} из {len(results)}")
+        if failed:
+            table = PrettyTable()
+            table.field_names = ["#", "user_id", "Ошибка"]
+            table.align = "l"
+            for r in failed:
+                table.add_row([r['index'], r['user_id'], f"{r['error_type']}: {r['error_message']}"])
+            print(table)
+
+    def handle_valuate_all(self, args):
+        bases = [base.strip().upper() for base in args.base.split(",") if base.strip()]
+        try:
+            report = usecases.valuate_all(bases, at=getattr(args, 'at', None))
+        except ValidationError as e:
+            print(f"Ошибка: {e}")
+            return
+
+        table = PrettyTable()
+        table.field_names = ["user_id", *(f"Стоимость ({base})" for base in bases)]
+        table.align = "r"
+        for user in report['users']:
+            table.add_row([user['user_id'], *(f"{user['totals'][base]:.2f}" for base in bases)])
+        print(f"Портфели ({len(report['users'])}):")
+        print(table)
+
+        exposure_table = PrettyTable()
+        exposure_table.field_names = ["Валюта", "Баланс", *(f"Стоимость ({base})" for base in bases)]
+        exposure_table.align = "r"
+        for code, item in report['exposure'].items():
+            exposure_table.add_row([code, f"{item['balance']:.4f}",
+                                    *(f"{item['value'][base]:.2f}" for base in bases)])
+        print("Экспозиция по валютам:")
+        print(exposure_table)
+        print("-" * 40)
+        for base in bases:
+            print(f"ИТОГО: {report['totals'][base]:.2f} {base}")
+        if report['unavailable_rates']:
+            print(f"Курсы недоступны или устарели (учтены как 0): {', '.join(report['unavailable_rates'])}")
+
+        if args.output:
+            try:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=4, default=str)
+                print(f"Отчет сохранен в {args.output}")
+            except OSError as e:
+                print(f"Ошибка: не удалось сохранить отчет: {e}")
+
+    def handle_show_candles(self, args):
+        from ..infra.candles import candles
+
+        pair = args.pair.upper().replace("/", "_")
+        try:
+            rows = candles.candles(pair, args.interval, args.start, args.end, limit=args.limit)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+        if not rows:
+            print(f"Свечей {pair} ({args.interval}) за указанный период нет.")
+            return
+
+        table = PrettyTable()
+        table.field_names = ["Начало (UTC)", "Open", "High", "Low", "Close", "Тиков"]
+        table.align = "r"
+        for row in rows:
+            table.add_row([row['start'][:19], f"{row['open']:.8f}", f"{row['high']:.8f}",
+                           f"{row['low']:.8f}", f"{row['close']:.8f}", row['count']])
+        print(f"Свечи {pair} ({args.interval}):")
+        print(table)
+
+    def handle_search_currency(self, args):
+        try:
+            currencies = usecases.search_currency(args.query, args.limit)
+        except ValidationError as e:
+            print(f"Ошибка: {e}")
+            return
+        if not currencies:
+            print(f"Валюты по запросу '{args.query}' не найдены.")
+            return
+
+        table = PrettyTable()
+        table.field_names = ["Код", "Тип", "Название", "Детали"]
+        table.align = "l"
+        for currency in currencies:
+            if isinstance(currency, FiatCurrency):
+                kind, details = "FIAT", currency.issuing_country
+            else:
+                kind, details = "CRYPTO", currency.algorithm
+            table.add_row([currency.code, kind, currency.name, details])
+        print(table)
+
+    def handle_rebuild_rate_history(self, args):
+        from ..infra.candles import candles
+        from ..infra.timeseries import history
+
+        try:
+            records = list(database_manager.get_exchange_rates_history().get('history', {}).values())
+            counts = history.rebuild(records)
+            candle_counts = candles.rebuild(records)
+        except Exception as e:
+            print(f"Ошибка пересборки истории: {e}")
+            return
+        print(f"История курсов пересобрана: пар {len(counts)}, точек {sum(counts.values())}.")
+        print("Свечи: " + ", ".join(f"{interval} — {count}" for interval, count in candle_counts.items()) + ".")
+
+    def handle_migrate_to_sqlite(self, args):
+        from ..infra.database import DatabaseManager
+        from ..infra.sqlite_database import SQLiteDatabaseManager, migrate_from_json
+
+        try:
+            target = SQLiteDatabaseManager()
+            counts = migrate_from_json(DatabaseManager(), target)
+            # Массовая перезапись портфелей не меняет их версий — кэш оценок сбрасывается явно
+            valuation_cache.invalidate()
+            print(f"Миграция завершена ({target.db_file}): пользователей {counts['users']}, "
+                  f"портфелей {counts['portfolios']}, курсов {counts['rates']}, записей истории {counts['history']}.")
+            print("Чтобы использовать SQLite, укажите \"storage_backend\": \"sqlite\" в config.json.")
+        except Exception as e:
+            print(f"Ошибка миграции: {e}")
+
+    def handle_reshard_portfolios(self, args):
+        reshard = getattr(database_manager, 'reshard_portfolios', None)
+        if reshard is None:
+            print("Ошибка: решардинг доступен только для JSON-хранилища.")
+            return
+        try:
+            result = reshard(args.shards)
+            valuation_cache.invalidate()
+            print(f"Портфели ({result['portfolios']}) разложены по {result['shards']} шардам.")
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+
     def run(self):
         configure_logging()
 
         # Логика интерактивного режима
         if len(sys.argv) == 1:
-            print("--- ValutaTrade Hub CLI (Интерактивный режим) ---")
-            print("Введите команды или 'exit' для выхода.")
-            while True:
-                try:
-                    user_input = input(f"VTH ({'Logged' if self.user_id else 'Guest'})> ")
-                    if not user_input.strip():
-                        continue
-
-                    if user_input.lower() == 'exit':
-                        print("Завершение работы.")
-                        break
-
-                    args_list = user_input.split()
-                    if not args_list:
-                        continue
-
-                    command = args_list[0]
-                    args_list = args_list[1:]
-
-                    # Парсинг для интерактивного режима
-                    if command == "register":
-                        parser_temp = argparse.ArgumentParser()
-                        parser_temp.add_argument("--username", required=True)
-                        parser_temp.add_argument("--password", required=True)
-                        args = parser_temp.parse_args(args_list)
-                        self.handle_register(args)
-                    elif command == "login":
-                        parser_temp = argparse.ArgumentParser()
-                        parser_temp.add_argument("--username", required=True)
-                        parser_temp.add_argument("--password", required=True)
-                        args = parser_temp.parse_args(args_list)
-                        self.handle_login(args)
-                    elif command == "show-portfolio":
-                        parser_temp = argparse.ArgumentParser()
-                        parser_temp.add_argument("--base", default="USD")
-                        args = parser_temp.parse_args(args_list)
-                        self.handle_show_portfolio(args)
-                    elif command == "buy":
-                        parser_temp = argparse.ArgumentParser()
-                        parser_temp.add_argument("--currency", required=True)
-                        parser_temp.add_argument("--amount", required=True, type=float)
-                        args = parser_temp.parse_args(args_list)
-                        self.handle_buy(args)
-                    elif command == "sell":
-                        parser_temp = argparse.ArgumentParser()
-                        parser_temp.add_argument("--currency", required=True)
-                        parser_temp.add_argument("--amount", required=True, type=float)
-                        args = parser_temp.parse_args(args_list)
-                        self.handle_sell(args)
-                    elif command == "get-rate":
-                        parser_temp = argparse.ArgumentParser()
-                        parser_temp.add_argument("--from", required=True, dest="from_currency")
-                        parser_temp.add_argument("--to", required=True, dest="to_currency")
-                        args = parser_temp.parse_args(args_list)
-                        self.handle_get_rate(args)
-                    elif command == "update-rates":
-                        parser_temp = argparse.ArgumentParser()
-                        parser_temp.add_argument("--source", choices=['coingecko', 'exchangerate'], default=None)
-                        args = parser_temp.parse_args(args_list)
-                        self.handle_update_rates(args)
-                    elif command == "show-rates":
-                        parser_temp = argparse.ArgumentParser()
-                        parser_temp.add_argument("--currency")
-                        parser_temp.add_argument("--top", type=int)
-                        parser_temp.add_argument("--base", default="USD")
-                        args = parser_temp.parse_args(args_list)
-                        self.handle_show_rates(args)
-                    else:
-                        print("Ошибка: Неизвестная команда")
-
-                except SystemExit:  # argparse вызывает SystemExit при ошибках
-                    pass
-                except Exception as e:
-                    print(f"Непредвиденная ошибка: {e}")
-
+            self.run_interactive()
         else:
             try:
                 args = self.parser.parse_args()
                 if hasattr(args, 'func'):
-                    args.func(self, args)
+                    args.func(args)
             except SystemExit:
                 pass
             except Exception as e:
                 print(f"Непредвиденная ошибка: {e}")
 
+    def run_interactive(self):
+        print("--- ValutaTrade Hub CLI (Интерактивный режим) ---")
+        print("Введите команды или 'exit' для выхода.")
+        while True:
+            try:
+                user_input = input(f"VTH ({'Logged' if self.user_id else 'Guest'})> ")
+                if not user_input.strip():
+                    continue
+
+                if user_input.lower() == 'exit':
+                    # Несброшенные сделки групповой фиксации записываются до выхода
+                    database_manager.flush()
+                    print("Завершение работы.")
+                    break
+
+                args_list = shlex.split(user_input)
+                if args_list[0] not in self.subparsers.choices:
+                    print("Ошибка: Неизвестная команда")
+                    continue
+
+                # Интерактивные команды разбираются теми же подпарсерами, что и командная строка
+                args = self.parser.parse_args(args_list)
+                args.func(args)
+
+            except SystemExit:  # argparse вызывает SystemExit при ошибках
+                pass
+            except Exception as e:
+                print(f"Непредвиденная ошибка: {e}")
 
 def main():
     cli = CLIInterface()
@@ -0,0 +1,113 @@
+# valutatrade_hub/core/cross_rates.py
+from decimal import Decimal
+
+from .rate_snapshot import IDENTITY_RATE, PairRate
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен: без него матрица строится только из Decimal
+    np = None
+
+
+class CrossRateMatrix:
+    """
+    Плотная матрица кросс-курсов между всеми валютами, у которых есть курсы.
+
+    По прямым парам строится граф: пара A_B с курсом r дает ребра A→B (r)
+    и B→A (1/r). Для каждой валюты ищется кратчайший путь до опорной
+    валюты pivot, из равных по длине — самый свежий. Кросс-курс i→j равен
+    value[i] / value[j], где value — стоимость единицы валюты в pivot;
+    прямые пары берутся как есть. Время обновления кросс-курса — самое
+    старое на пути, поэтому проверка свежести работает как для прямой
+    пары. Поиск курса — O(1) по индексам.
+    """
+
+    def __init__(self, pairs, codes=None, pivot='USD'):
+        """
+        pairs — прямые курсы {'FROM_TO': PairRate} из RateSnapshot. Валюты
+        справочника без курсов в матрицу не входят: для них lookup дает None.
+        """
+        codes = list(codes) if codes is not None else [pivot]
+        edges = self._build_edges(pairs, codes)
+
+        self.codes = codes
+        self.index = {code: i for i, code in enumerate(codes)}
+        self.pivot = pivot
+        values, oldest = self._values_in_pivot(edges, pivot)
+
+        # Плотная матрица PairRate (None — валюты не связаны курсами)
+        n = len(codes)
+        self._rates = [[None] * n for _ in range(n)]
+        for i, from_code in enumerate(codes):
+            if from_code not in values:
+                continue
+            for j, to_code in enumerate(codes):
+                if to_code not in values:
+                    continue
+                stamp = _older(oldest[from_code], oldest[to_code])
+                self._rates[i][j] = PairRate(values[from_code] / values[to_code], stamp.updated_at,
+                                             stamp.updated_epoch, stamp.expires_at)
+        for pair_key, pair_rate in pairs.items():
+            from_code, to_code = pair_key.split('_')
+            self._rates[self.index[from_code]][self.index[to_code]] = pair_rate
+        for i in range(n):
+            self._rates[i][i] = IDENTITY_RATE
+
+        # float64-копия для векторных расчетов (NaN — курса нет)
+        self.array = None
+        if np is not None:
+            vector = np.array([float(values[code]) if code in values else np.nan for code in codes])
+            self.array = vector[:, None] / vector[None, :]
+
+    @staticmethod
+    def _build_edges(pairs, codes):
+        """
+        Граф курсов: валюта -> [(соседняя валюта, сколько единиц валюты стоит
+        1 соседней, курс пары)]. Валюты пар, которых нет в codes, дописываются в codes.
+        """
+        edges = {}
+        for pair_key, pair_rate in pairs.items():
+            from_code, to_code = pair_key.split('_')
+            for code in (from_code, to_code):
+                if code not in codes:
+                    codes.append(code)
+            edges.setdefault(to_code, []).append((from_code, pair_rate.rate, pair_rate))
+            edges.setdefault(from_code, []).append((to_code, 1 / pair_rate.rate, pair_rate))
+        return edges
+
+    @staticmethod
+    def _values_in_pivot(edges, pivot):
+        """
+        Поиск в ширину от pivot: стоимость каждой достижимой валюты в pivot
+        и самый старый курс на ее пути.
+        """
+        values = {pivot: Decimal(1)}
+        oldest = {pivot: IDENTITY_RATE}
+        frontier = [pivot]
+        while frontier:
+            candidates = {}
+            for code in frontier:
+                for neighbor, rate, pair_rate in edges.get(code, ()):
+                    if neighbor in values:
+                        continue
+                    stamp = _older(oldest[code], pair_rate)
+                    best = candidates.get(neighbor)
+                    if best is None or stamp.updated_epoch > best[1].updated_epoch:
+                        candidates[neighbor] = (values[code] * rate, stamp)
+            for code, (value, stamp) in candidates.items():
+                values[code] = value
+                oldest[code] = stamp
+            frontier = list(candidates)
+        return values, oldest
+
+    def lookup(self, from_currency, to_currency):
+        """PairRate для пары from→to или None, если валюты неизвестны или не связаны курсами."""
+        i = self.index.get(from_currency)
+        j = self.index.get(to_currency)
+        if i is None or j is None:
+            return None
+        return self._rates[i][j]
+
+
+def _older(first, second):
+    return first if first.updated_epoch <= second.updated_epoch else second
@@ -1,19 +1,39 @@
 # valutatrade_hub/core/currencies.py
+import bisect
+import difflib
+import itertools
+import json
+import logging
 import re
+import threading
 from abc import ABC
 from decimal import Decimal
+from pathlib import Path
 
+from ..infra.settings import settings_loader
 from .exceptions import CurrencyNotFoundError, ValidationError
 
+logger = logging.getLogger(__name__)
+
+# Коды тикеров: латиница и цифры (в списках криптоактивов встречаются 1INCH, USDC и т. п.)
+_CODE_RE = re.compile(r"[A-Z0-9]{2,10}")
+
 
 class Currency(ABC):
     """Абстрактный базовый класс для всех валют"""
 
-    def __init__(self, name: str, code: str):
+    __slots__ = ("_name", "_code", "_minor_units", "_frozen")
+
+    DEFAULT_MINOR_UNITS = 2
+
+    def __init__(self, name: str, code: str, minor_units: int = None):
         self._validate_code(code)
         self._validate_name(name)
+        minor_units = self.DEFAULT_MINOR_UNITS if minor_units is None else minor_units
+        self._validate_minor_units(minor_units)
         self._name = name
         self._code = code
+        self._minor_units = minor_units
 
     @property
     def name(self) -> str:
@@ -33,12 +53,31 @@ class Currency(ABC):
         self._validate_code(value)
         self._code = value
 
+    @property
+    def minor_units(self) -> int:
+        """Число знаков после запятой у минимальной единицы (2 — центы, 8 — сатоши)."""
+        return self._minor_units
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"{self.__class__.__name__} is immutable")
+        super().__setattr__(name, value)
+
+    def _freeze(self):
+        """Запрещает изменение экземпляра (экземпляры справочника общие для всего приложения)."""
+        object.__setattr__(self, "_frozen", True)
+
     def _validate_code(self, code: str):
-        if not re.fullmatch(r"^[A-Z]{2,5}$", code):
+        if not _CODE_RE.fullmatch(code):
             raise ValidationError(
-                f"Код валюты '{code}' должен быть в верхнем регистре, от 2 до 5 символов и без пробелов."
+                f"Код валюты '{code}' должен быть в верхнем регистре, от 2 до 10 латинских букв или цифр."
             )
 
+    def _validate_minor_units(self, value: int):
+        # Балансы в минимальных единицах должны помещаться в int64 для векторных расчетов
+        if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= 9:
+            raise ValidationError("Число знаков минимальной единицы валюты должно быть целым от 0 до 9.")
+
     def _validate_name(self, name: str):
         if not name or not name.strip():
             raise ValidationError("Имя валюты не может быть пустым.")
@@ -57,8 +96,10 @@ class Currency(ABC):
 class FiatCurrency(Currency):
     """Класс для фиатных валют."""
 
-    def __init__(self, name: str, code: str, issuing_country: str):
-        super().__init__(name, code)
+    __slots__ = ("_issuing_country",)
+
+    def __init__(self, name: str, code: str, issuing_country: str, minor_units: int = None):
+        super().__init__(name, code, minor_units)
         self._validate_issuing_country(issuing_country)
         self._issuing_country = issuing_country
 
@@ -82,8 +123,12 @@ class FiatCurrency(Currency):
 class CryptoCurrency(Currency):
     """Класс для криптовалют."""
 
-    def __init__(self, name: str, code: str, algorithm: str, market_cap: Decimal):
-        super().__init__(name, code)
+    __slots__ = ("_algorithm", "_market_cap")
+
+    DEFAULT_MINOR_UNITS = 8
+
+    def __init__(self, name: str, code: str, algorithm: str, market_cap: Decimal, minor_units: int = None):
+        super().__init__(name, code, minor_units)
         self._validate_algorithm(algorithm)
         self._validate_market_cap(market_cap)
         self._algorithm = algorithm
@@ -119,20 +164,169 @@ class CryptoCurrency(Currency):
         return f"[CRYPTO] {self.code} — {self.name} (Algo: {self.algorithm}, MCAP: {self.market_cap:.2e})"
 
 
-# --- Реестр валют (фабрика) ---
-_currency_registry = {
-    "USD": FiatCurrency(name="US Dollar", code="USD", issuing_country="United States"),
-    "EUR": FiatCurrency(name="Euro", code="EUR", issuing_country="Eurozone"),
-    "RUB": FiatCurrency(name="Russian Ruble", code="RUB", issuing_country="Russian Federation"),
-    "BTC": CryptoCurrency(name="Bitcoin", code="BTC", algorithm="SHA-256", market_cap=Decimal("1120000000000")),
-    "ETH": CryptoCurrency(name="Ethereum", code="ETH", algorithm="Ethash", market_cap=Decimal("450000000000")),
-}
+# --- Реестр валют (справочник из файла данных) ---
+_DEFAULT_CURRENCIES_FILE = Path(__file__).with_name("currencies.json")
+
+
+class CurrencyRegistry:
+    """
+    Справочник валют, загружаемый из JSON-файла (список записей с полями
+    code/symbol, name, type, issuing_country или algorithm/market_cap).
+    Подходит для десятков тысяч активов, например полного списка CoinGecko.
+
+    Файл читается при первом обращении. Поиск по коду — O(1) по словарю;
+    объекты Currency создаются по требованию, один раз на код, и замораживаются,
+    поэтому модели и use case'ы разделяют одни и те же экземпляры.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._records = None  # код -> запись файла
+        self._codes = ()  # отсортированные коды для поиска по префиксу
+        self._names = ()  # отсортированные (name.lower(), код)
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._records is None:
+            with self._lock:
+                if self._records is None:
+                    self._load()
+        return self._records
+
+    def _load(self):
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+
+        records = {}
+        skipped = 0
+        for entry in entries:
+            code = str(entry.get('code') or entry.get('symbol') or '').upper()
+            name = str(entry.get('name') or '').strip()
+            # При повторе кода (в списках CoinGecko это обычно) остается первая запись
+            if code in records or not _CODE_RE.fullmatch(code) or not name:
+                skipped += 1
+                continue
+            records[code] = entry
+        if skipped:
+            logger.warning("Skipped %d invalid or duplicate currency records in %s", skipped, self.file_path)
+
+        self._codes = tuple(sorted(records))
+        self._names = tuple(sorted((str(entry['name']).strip().lower(), code) for code, entry in records.items()))
+        self._records = records
+
+    def _build(self, code, entry) -> Currency:
+        name = str(entry['name']).strip()
+        if entry.get('type', 'crypto') == 'fiat':
+            currency = FiatCurrency(name=name, code=code, issuing_country=entry.get('issuing_country') or 'n/a',
+                                    minor_units=entry.get('minor_units'))
+        else:
+            currency = CryptoCurrency(name=name, code=code, algorithm=entry.get('algorithm') or 'n/a',
+                                      market_cap=Decimal(str(entry.get('market_cap') or 0)),
+                                      minor_units=entry.get('minor_units'))
+        currency._freeze()
+        return currency
+
+    def get(self, code: str) -> Currency:
+        """Объект Currency по коду (без учета регистра)."""
+        code = code.upper()
+        currency = self._instances.get(code)
+        if currency is not None:
+            return currency
+        entry = self._ensure_loaded().get(code)
+        if entry is None:
+            raise CurrencyNotFoundError(f"Неизвестная валюта '{code}'", code=code)
+        with self._lock:
+            currency = self._instances.get(code)
+            if currency is None:
+                currency = self._instances[code] = self._build(code, entry)
+        return currency
+
+    def __contains__(self, code) -> bool:
+        return isinstance(code, str) and code.upper() in self._ensure_loaded()
+
+    def __len__(self) -> int:
+        return len(self._ensure_loaded())
+
+    def codes(self) -> list[str]:
+        self._ensure_loaded()
+        return list(self._codes)
+
+    def search(self, query: str, limit: int = 10) -> list[Currency]:
+        """
+        Поиск для CLI: точный код, затем коды и названия с этим префиксом,
+        затем вхождение в название; если ничего не нашлось — нечеткое сравнение.
+        """
+        self._ensure_loaded()
+        query = query.strip()
+        if not query or limit <= 0:
+            return []
+        code_query, name_query = query.upper(), query.lower()
+        found = self._first_unique(self._matches(code_query, name_query), limit)
+        if not found:
+            found = self._first_unique(self._fuzzy_matches(code_query, name_query, limit), limit)
+        return self._currencies(found)
+
+    def _matches(self, code_query, name_query):
+        """Коды по убыванию точности: код, префикс кода, префикс названия, вхождение в название."""
+        if code_query in self._records:
+            yield code_query
+        yield from self._prefixed(self._codes, code_query)
+        start = bisect.bisect_left(self._names, (name_query,))
+        for name, code in itertools.islice(self._names, start, None):
+            if not name.startswith(name_query):
+                break
+            yield code
+        for name, code in self._names:
+            if name_query in name:
+                yield code
+
+    def _fuzzy_matches(self, code_query, name_query, limit):
+        """Нечеткие совпадения кодов и названий, слитые по степени сходства."""
+        names = dict(self._names)
+        close = [(difflib.SequenceMatcher(None, code_query, code).ratio(), code)
+                 for code in difflib.get_close_matches(code_query, self._codes, n=limit, cutoff=0.6)]
+        close += [(difflib.SequenceMatcher(None, name_query, name).ratio(), names[name])
+                  for name in difflib.get_close_matches(name_query, names, n=limit, cutoff=0.6)]
+        for _, code in sorted(close, key=lambda item: -item[0]):
+            yield code
+
+    @staticmethod
+    def _first_unique(codes, limit):
+        """Первые limit различных кодов (генераторы дальше не перебираются)."""
+        found = []
+        for code in codes:
+            if code not in found:
+                found.append(code)
+                if len(found) >= limit:
+                    break
+        return found
+
+    @staticmethod
+    def _prefixed(sorted_codes, prefix):
+        start = bisect.bisect_left(sorted_codes, prefix)
+        for code in itertools.islice(sorted_codes, start, None):
+            if not code.startswith(prefix):
+                break
+            yield code
+
+    def _currencies(self, codes):
+        return [self.get(code) for code in codes]
+
+
+currency_registry = CurrencyRegistry(settings_loader.get('currencies_file') or _DEFAULT_CURRENCIES_FILE)
 
 
 def get_currency(code: str) -> Currency:
     """Возвращает объект Currency по его коду"""
-    code = code.upper()
-    currency = _currency_registry.get(code)
-    if not currency:
-        raise CurrencyNotFoundError(f"Неизвестная валюта '{code}'", code=code)
-    return currency
+    return currency_registry.get(code)
+
+
+def get_currency_codes() -> list[str]:
+    """Коды всех валют справочника."""
+    return currency_registry.codes()
+
+
+def search_currencies(query: str, limit: int = 10) -> list[Currency]:
+    """Поиск валют по коду или названию (префикс, вхождение, нечеткое совпадение)."""
+    return currency_registry.search(query, limit)
@@ -27,10 +27,15 @@ class CurrencyNotFoundError(Exception):
         self.code = code
 
 class ApiRequestError(Exception):
-    """Исключение для сбоев при обращении к внешнему API"""
-    def __init__(self, message, reason=None):
+    """
+    Исключение для сбоев при обращении к внешнему API.
+    retryable — сбой временный (сеть, 429, 5xx); retry_after — пауза из Retry-After, с.
+    """
+    def __init__(self, message, reason=None, retryable=False, retry_after=None):
         super().__init__(message)
         self.reason = reason
+        self.retryable = retryable
+        self.retry_after = retry_after
 
 # Дополнительные исключения, если потребуются в будущем
 class PortfolioError(Exception):
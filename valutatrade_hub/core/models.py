@@ -1,128 +1,20 @@
 # valutatrade_hub/core/models.py
-import re
 from decimal import Decimal
+from types import MappingProxyType
 
-from .currencies import get_currency 
+# Классы валют определены в currencies.py; здесь реэкспорт для старых импортов
+from .currencies import CryptoCurrency, Currency, FiatCurrency, get_currency  # noqa: F401
 from .exceptions import CurrencyNotFoundError, InsufficientFundsError, ValidationError
-
-
-class Currency:
-    """Абстрактный базовый класс для всех валют"""
-
-    def __init__(self, name: str, code: str):
-        self._validate_code(code)
-        self._validate_name(name)
-        self._name = name
-        self._code = code
-
-    @property
-    def name(self) -> str:
-        return self._name
-
-    @name.setter
-    def name(self, value: str):
-        self._validate_name(value)
-        self._name = value
-
-    @property
-    def code(self) -> str:
-        return self._code
-
-    @code.setter
-    def code(self, value: str):
-        self._validate_code(value)
-        self._code = value
-
-    def _validate_code(self, code: str):
-        if not re.fullmatch(r"^[A-Z]{2,5}$", code):
-            raise ValidationError(
-                f"Код валюты '{code}' должен быть в верхнем регистре, от 2 до 5 символов и без пробелов."
-            )
-
-    def _validate_name(self, name: str):
-        if not name or not name.strip():
-            raise ValidationError("Имя валюты не может быть пустым.")
-
-    def get_display_info(self) -> str:
-        """Возвращает строковое представление валюты для UI/логов."""
-        return f"[{self.__class__.__name__.upper()}] {self.code} - {self.name}"
-
-    def __str__(self):
-        return self.get_display_info()
-
-    def __repr__(self):
-        return f"{self.__class__.__name__}(code='{self.code}', name='{self.name}')"
-
-
-class FiatCurrency(Currency):
-    """Класс для фиатных валют."""
-
-    def __init__(self, name: str, code: str, issuing_country: str):
-        super().__init__(name, code)
-        self._validate_issuing_country(issuing_country)
-        self._issuing_country = issuing_country
-
-    @property
-    def issuing_country(self) -> str:
-        return self._issuing_country
-
-    @issuing_country.setter
-    def issuing_country(self, value: str):
-        self._validate_issuing_country(value)
-        self._issuing_country = value
-
-    def _validate_issuing_country(self, value: str):
-        if not value or not value.strip():
-            raise ValidationError("Страна-эмитент не может быть пустой.")
-
-    def get_display_info(self) -> str:
-        return f"[FIAT] {self.code} — {self.name} (Issuing: {self.issuing_country})"
-
-
-class CryptoCurrency(Currency):
-    """Класс для криптовалют"""
-
-    def __init__(self, name: str, code: str, algorithm: str, market_cap: Decimal):
-        super().__init__(name, code)
-        self._validate_algorithm(algorithm)
-        self._validate_market_cap(market_cap)
-        self._algorithm = algorithm
-        self._market_cap = market_cap
-
-    @property
-    def algorithm(self) -> str:
-        return self._algorithm
-
-    @algorithm.setter
-    def algorithm(self, value: str):
-        self._validate_algorithm(value)
-        self._algorithm = value
-
-    @property
-    def market_cap(self) -> Decimal:
-        return self._market_cap
-
-    @market_cap.setter
-    def market_cap(self, value: Decimal):
-        self._validate_market_cap(value)
-        self._market_cap = value
-
-    def _validate_algorithm(self, value: str):
-        if not value or not value.strip():
-            raise ValidationError("Алгоритм не может быть пустым.")
-
-    def _validate_market_cap(self, value: Decimal):
-        if not isinstance(value, Decimal) or value < 0:
-            raise ValidationError("Рыночная капитализация должна быть положительным числом Decimal.")
-
-    def get_display_info(self) -> str:
-        return f"[CRYPTO] {self.code} — {self.name} (Algo: {self.algorithm}, MCAP: {self.market_cap:.2e})"
+from .money import exact_units, make_wallet, scale_of, wallet_units
+from .rate_snapshot import RateSnapshot, rate_snapshot_for
 
 
 # --- User Class ---
 class User:
     """Пользователь системы"""
 
+    __slots__ = ("_user_id", "_username", "_hashed_password", "_salt", "_registration_date")
+
     def __init__(self, user_id: int, username: str, hashed_password: str, salt: str, registration_date: str):
         self._user_id = user_id
         self._username = username
@@ -130,6 +22,12 @@ class User:
         self._salt = salt
         self._registration_date = registration_date
 
+    @classmethod
+    def from_dict(cls, data: dict) -> 'User':
+        """Создает пользователя из записи хранилища (users.json / SQLite)."""
+        return cls(data['user_id'], data['username'], data['hashed_password'], data['salt'],
+                   data.get('registration_date'))
+
     @property
     def user_id(self) -> int:
         return self._user_id
@@ -174,21 +72,42 @@ class User:
 class Wallet:
     """Кошелёк пользователя для одной конкретной валюты."""
 
+    __slots__ = ("currency_code", "_units", "_scale")
+
     def __init__(self, currency_code: str, balance: Decimal = Decimal("0.0")):
         # ВАЖНО: Валидация currency_code теперь через get_currency из currencies.py
         try:
-            get_currency(currency_code)  # Проверка существования валюты
+            currency = get_currency(currency_code)  # Проверка существования валюты
         except CurrencyNotFoundError as e:
             raise ValidationError(f"Недопустимый код валюты: {e}") from e
 
         self.currency_code = currency_code
+        self._scale = currency.minor_units
         if not isinstance(balance, Decimal):
-            balance = Decimal(balance)
-        self._balance = balance  # Изначально присваиваем, setter выполнит валидацию
+            balance = Decimal(str(balance))
+        # Баланс хранится в минимальных единицах; суммы точнее них отклоняются, как в сделках
+        self._units = exact_units(balance, currency_code)
+
+    @classmethod
+    def from_storage(cls, currency_code: str, wallet: dict) -> 'Wallet':
+        """
+        Создает кошелек из доверенной записи хранилища ({"units", "scale"} или
+        старого {"balance"}) без повторной проверки кода валюты по справочнику.
+        """
+        instance = cls.__new__(cls)
+        instance.currency_code = currency_code
+        instance._scale = scale_of(currency_code)
+        instance._units = wallet_units(wallet, currency_code)
+        return instance
+
+    @property
+    def units(self) -> int:
+        """Баланс в минимальных единицах валюты (центы, сатоши)."""
+        return self._units
 
     @property
     def balance(self) -> Decimal:
-        return self._balance
+        return Decimal(self._units).scaleb(-self._scale)
 
     @balance.setter
     def balance(self, value: Decimal):
@@ -196,13 +115,13 @@ class Wallet:
             raise ValidationError("Баланс должен быть числом Decimal.")
         if value < 0:
             raise ValidationError("Баланс не может быть отрицательным.")
-        self._balance = value
+        self._units = exact_units(value, self.currency_code)
 
     def deposit(self, amount: Decimal):
         """Пополнение баланса."""
         if not isinstance(amount, Decimal) or amount <= 0:
             raise ValidationError("Сумма пополнения должна быть положительным числом Decimal.")
-        self.balance += amount
+        self._units += exact_units(amount, self.currency_code)
 
     def withdraw(self, amount: Decimal):
         """Снятие средств (если баланс позволяет)."""
@@ -216,7 +135,7 @@ class Wallet:
                 required_amount=amount,
                 currency_code=self.currency_code
             )
-        self.balance -= amount
+        self._units -= exact_units(amount, self.currency_code)
 
     def get_balance_info(self) -> str:
         return f"Баланс: {self.balance} {self.currency_code}"
@@ -226,25 +145,39 @@ class Wallet:
 class Portfolio:
     """Управление всеми кошельками одного пользователя."""
 
+    __slots__ = ("_user_id", "_wallets")
+
     def __init__(self, user_id: int, wallets: dict[str, Wallet] = None):
         self._user_id = user_id
         self._wallets = wallets if wallets is not None else {}
 
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Portfolio':
+        """Создает портфель из записи хранилища; кошельки гидрируются без повторной валидации."""
+        return cls(data['user_id'], {code: Wallet.from_storage(code, wallet)
+                                     for code, wallet in data.get('wallets', {}).items()})
+
+    def to_dict(self) -> dict:
+        """Запись для хранилища (балансы в минимальных единицах, как в portfolios.json)."""
+        return {"user_id": self._user_id,
+                "wallets": {code: make_wallet(wallet.units, code) for code, wallet in self._wallets.items()}}
+
     @property
     def user_id(self) -> int:
         return self._user_id
 
     @property
-    def wallets(self) -> dict[str, Wallet]:
-        return self._wallets.copy()
+    def wallets(self) -> MappingProxyType:
+        """Кошельки только для чтения (без копирования словаря)."""
+        return MappingProxyType(self._wallets)
 
     def add_currency(self, currency_code: str) -> 'Wallet': # Добавил возврат типа Wallet
         """
-        Добавляет новый кошелёк в портфель, если его нет. 
+        Добавляет новый кошелёк в портфель, если его нет.
         Если кошелек уже существует, возвращает существующий объект Wallet.
         """
         currency_code = currency_code.upper()
-        
+
         try:
             get_currency(currency_code)  # Проверка существования валюты в справочнике
         except CurrencyNotFoundError as e:
@@ -255,12 +188,16 @@ class Portfolio:
             # Создаем новый кошелек, если он не найден
             self._wallets[currency_code] = Wallet(currency_code=currency_code)
             # Здесь можно добавить лог, что кошелек был создан, если нужно.
-        
+
         # Возвращаем существующий или только что созданный кошелек
         return self._wallets[currency_code]
 
     def get_total_value(self, base_currency='USD', exchange_rates=None) -> Decimal:
-        """Возвращает общую стоимость всех валют пользователя в указанной базовой валюте."""
+        """
+        Возвращает общую стоимость всех валют пользователя в указанной базовой валюте.
+        exchange_rates — RateSnapshot или документ rates.json; курсы между
+        валютами без прямой пары считаются через опорную валюту.
+        """
         total_value = Decimal('0.0')
         if exchange_rates is None:
             exchange_rates = {}  # Заглушка
@@ -270,34 +207,13 @@ class Portfolio:
         except CurrencyNotFoundError as e:
             raise ValidationError(f"Неизвестная базовая валюта '{base_currency}'.") from e
 
+        if not isinstance(exchange_rates, RateSnapshot):
+            exchange_rates = rate_snapshot_for(exchange_rates)
+
         for currency_code, wallet in self._wallets.items():
-            balance = wallet.balance
-            if currency_code == base_currency:
-                total_value += balance
-            else:
-                rate_key = f"{currency_code}_{base_currency}"
-
-                # Проверяем наличие курса в 'rates' и сам курс
-                rate_info = exchange_rates.get('pairs', {}).get(rate_key)
-
-                # Если rate_info нет, попробуем перевернуть пару валют (base->currency)
-                if not rate_info and base_currency != 'USD':
-                    rate_key_reversed = f"{base_currency}_{currency_code}"
-                    rate_info = exchange_rates.get('pairs', {}).get(rate_key_reversed)
-                    if rate_info and 'rate' in rate_info:
-                        try:
-                            rate_value = Decimal('1.0') / Decimal(rate_info['rate'])
-                            total_value += balance * rate_value
-                            continue  # переходим к следующей валюте
-                        except (ValueError, TypeError, ZeroDivisionError):
-                            pass  # Обработка ошибки (лог или что-то еще)
-                if rate_info and 'rate' in rate_info:
-                    try:
-                        rate_value = Decimal(rate_info['rate'])
-                        total_value += balance * rate_value
-                    except (ValueError, TypeError):
-                        # Игнорируем ошибки конвертации для отдельной валюты
-                        pass
+            pair_rate = exchange_rates.get(currency_code, base_currency)
+            if pair_rate is not None:
+                total_value += wallet.balance * pair_rate.rate
         return total_value
 
     def get_wallet(self, currency_code: str) -> Wallet:
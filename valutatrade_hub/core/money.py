@@ -0,0 +1,60 @@
+# valutatrade_hub/core/money.py
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from .currencies import get_currency
+from .exceptions import ValidationError
+
+# Балансы хранятся и считаются целыми числами минимальных единиц валюты
+# (центы для USD, сатоши для BTC). Кошелек в хранилище: {"units": 12345, "scale": 2},
+# где scale — число знаков после запятой. Decimal нужен только для отображения.
+
+_scale_cache = {}
+
+
+def scale_of(code: str) -> int:
+    """Число знаков минимальной единицы валюты из справочника."""
+    scale = _scale_cache.get(code)
+    if scale is None:
+        scale = _scale_cache[code] = get_currency(code).minor_units
+    return scale
+
+
+def to_units(amount, code: str, rounding=ROUND_HALF_EVEN) -> int:
+    """Decimal-сумма -> целое число минимальных единиц с заданным правилом округления."""
+    amount = amount if isinstance(amount, Decimal) else Decimal(str(amount))
+    return int(amount.scaleb(scale_of(code)).to_integral_value(rounding=rounding))
+
+
+def exact_units(amount: Decimal, code: str) -> int:
+    """Как to_units, но сумма должна точно выражаться в минимальных единицах."""
+    scaled = amount.scaleb(scale_of(code))
+    if scaled != scaled.to_integral_value():
+        raise ValidationError(f"Сумма {amount} {code} точнее минимальной единицы валюты "
+                              f"({scale_of(code)} знаков после запятой).")
+    return int(scaled)
+
+
+def from_units(units: int, code: str) -> Decimal:
+    """Целое число минимальных единиц -> Decimal (только для отображения и сообщений)."""
+    return Decimal(units).scaleb(-scale_of(code))
+
+
+def wallet_units(wallet: dict, code: str) -> int:
+    """
+    Баланс кошелька из хранилища в минимальных единицах текущей шкалы валюты.
+    Понимает и старый формат {"balance": "12.34"}; если шкала валюты в
+    справочнике изменилась, значение пересчитывается с банковским округлением.
+    """
+    units = wallet.get('units')
+    if units is None:
+        return to_units(Decimal(str(wallet.get('balance', 0))), code)
+    scale = scale_of(code)
+    stored_scale = wallet.get('scale', scale)
+    if stored_scale == scale:
+        return units
+    return int(Decimal(units).scaleb(scale - stored_scale).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def make_wallet(units: int, code: str) -> dict:
+    """Запись кошелька для хранилища."""
+    return {"units": units, "scale": scale_of(code)}
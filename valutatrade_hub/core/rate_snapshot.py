@@ -0,0 +1,150 @@
+# valutatrade_hub/core/rate_snapshot.py
+import math
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+
+from ..infra.settings import settings_loader
+from ..infra.timeseries import from_epoch_us, history, to_epoch_us
+
+RATE_TTL_SECONDS = settings_loader.get('rates_ttl_seconds', 300)
+
+# Интернированные ключи пар: (FROM, TO) -> 'FROM_TO', чтобы не собирать строку на каждый поиск
+_pair_ids = {}
+
+
+def pair_id(from_currency: str, to_currency: str) -> str:
+    """Интернированный ключ пары вида 'BTC_USD'."""
+    key = (from_currency, to_currency)
+    pair = _pair_ids.get(key)
+    if pair is None:
+        pair = _pair_ids[key] = sys.intern(f"{from_currency}_{to_currency}")
+    return pair
+
+
+class PairRate(NamedTuple):
+    """Разобранный курс пары: Decimal-курс и моменты обновления/устаревания (секунды epoch)."""
+    rate: Decimal
+    updated_at: Optional[str]
+    updated_epoch: float
+    expires_at: float
+    source: Optional[str] = None
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return (time.time() if now is None else now) <= self.expires_at
+
+
+# Курс валюты к самой себе: всегда 1 и никогда не устаревает
+IDENTITY_RATE = PairRate(Decimal(1), None, math.inf, math.inf)
+
+
+class RateSnapshot:
+    """
+    Неизменяемый снимок rates.json, разобранный один раз при загрузке.
+
+    Курсы хранятся в Decimal, время устаревания каждой пары посчитано
+    заранее (updated_at + TTL), поэтому проверка свежести — сравнение
+    чисел. Кросс-курсы строятся при первом обращении к матрице.
+    """
+
+    __slots__ = ("_pairs", "_last_refresh", "_version", "_pivot", "_cross")
+
+    def __init__(self, rates, ttl_seconds=RATE_TTL_SECONDS, pivot='USD'):
+        pairs = {}
+        for key, rate_info in rates.get('pairs', {}).items():
+            try:
+                from_code, to_code = key.split('_')
+                rate = Decimal(str(rate_info['rate']))
+                updated_at = rate_info.get('updated_at')
+                updated_epoch = to_epoch_us(updated_at) / 1_000_000 if updated_at else -math.inf
+            except (ValueError, KeyError, TypeError, InvalidOperation):
+                continue
+            if not rate.is_finite() or rate <= 0:
+                continue
+            pairs[pair_id(from_code, to_code)] = PairRate(
+                rate, updated_at, updated_epoch, updated_epoch + ttl_seconds, rate_info.get('source'))
+
+        object.__setattr__(self, "_pairs", MappingProxyType(pairs))
+        object.__setattr__(self, "_last_refresh", rates.get('last_refresh'))
+        # Счетчик обновлений курсов; в старых файлах его нет — версией служит last_refresh
+        object.__setattr__(self, "_version", rates.get('version', rates.get('last_refresh')))
+        object.__setattr__(self, "_pivot", pivot)
+        object.__setattr__(self, "_cross", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RateSnapshot is immutable")
+
+    @property
+    def pairs(self):
+        """Прямые пары: pair_id -> PairRate (только для чтения)."""
+        return self._pairs
+
+    @property
+    def last_refresh(self):
+        return self._last_refresh
+
+    @property
+    def version(self):
+        """Версия курсов: меняется при каждом RateStorage.save_current_rates."""
+        return self._version
+
+    @property
+    def pivot(self):
+        return self._pivot
+
+    @property
+    def cross_rates(self):
+        """Матрица кросс-курсов через опорную валюту (строится один раз)."""
+        if self._cross is None:
+            from .cross_rates import CrossRateMatrix
+
+            object.__setattr__(self, "_cross", CrossRateMatrix(self._pairs, pivot=self._pivot))
+        return self._cross
+
+    def direct(self, from_currency, to_currency) -> Optional[PairRate]:
+        """Курс только из прямой пары rates.json."""
+        return self._pairs.get(pair_id(from_currency, to_currency))
+
+    def get(self, from_currency, to_currency) -> Optional[PairRate]:
+        """Курс from→to: прямая пара, иначе кросс-курс; None, если курса нет."""
+        if from_currency == to_currency:
+            return IDENTITY_RATE
+        rate = self._pairs.get(pair_id(from_currency, to_currency))
+        if rate is None:
+            rate = self.cross_rates.lookup(from_currency, to_currency)
+        return rate
+
+
+_snapshot_cache = (None, None, None)  # (документ курсов, его last_refresh, снимок)
+
+
+def rate_snapshot_for(rates, pivot='USD'):
+    """
+    RateSnapshot для документа rates. Строится один раз на каждое обновление
+    курсов: кэш документов возвращает тот же объект, пока файл не изменится,
+    а обновление на месте меняет last_refresh.
+    """
+    global _snapshot_cache
+    cached_rates, last_refresh, snapshot = _snapshot_cache
+    if cached_rates is not rates or last_refresh != rates.get('last_refresh') or snapshot.pivot != pivot:
+        snapshot = RateSnapshot(rates, pivot=pivot)
+        _snapshot_cache = (rates, rates.get('last_refresh'), snapshot)
+    return snapshot
+
+
+def historical_rate_snapshot(at, pivot='USD'):
+    """
+    RateSnapshot на момент at (ISO-строка UTC или datetime) по колоночной
+    истории: для каждой пары берется последний курс не позже at, поиск —
+    O(log n) на пару. Курсы в таком снимке не устаревают.
+    """
+    pairs = {}
+    for pair in history.pairs():
+        point = history.rate_at(pair, at)
+        if point is not None:
+            timestamp, rate = point
+            pairs[pair] = {"rate": str(rate), "updated_at": from_epoch_us(timestamp), "source": "history"}
+    at_iso = at if isinstance(at, str) else at.isoformat()
+    return RateSnapshot({"pairs": pairs, "last_refresh": at_iso}, ttl_seconds=math.inf, pivot=pivot)
@@ -1,12 +1,14 @@
 # valutatrade_hub/core/usecases.py
+import copy
 import hashlib
 import secrets
 from datetime import datetime, timedelta
-from decimal import Decimal
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
 
 from ..decorators import log_action
 from ..infra.database import database_manager
 from ..infra.settings import settings_loader
+from .currencies import get_currency, search_currencies
 from .exceptions import (
     ApiRequestError,
     CurrencyNotFoundError,
@@ -15,17 +17,14 @@ from .exceptions import (
     UserNotFoundError,
     ValidationError,
 )
-from .models import get_currency
+from .money import exact_units, from_units, make_wallet, to_units, wallet_units
+from .rate_snapshot import PairRate, historical_rate_snapshot, rate_snapshot_for
+from .valuation import valuate_portfolios, valuation_cache
 
 BASE_CURRENCY = settings_loader.get('default_base_currency', 'USD')
 RATE_TTL_SECONDS = settings_loader.get('rates_ttl_seconds', 300)  # Используем настройку TTL
 
 
-def generate_user_id(users):
-    """Генерирует новый user_id"""
-    return max((user['user_id'] for user in users), default=0) + 1
-
-
 @log_action()
 def register_user(username, password):
     """Регистрирует нового пользователя."""
@@ -34,35 +33,32 @@ def register_user(username, password):
     if len(password) < 4:
         raise ValidationError("Пароль должен быть не короче 4 символов.")
 
-    existing_user = database_manager.get_user_by_username(username)
-    if existing_user:
-        raise UserNotFoundError(f"Имя пользователя '{username}' уже занято.")
-
-    # Явно преобразуем в список
-    users = list(database_manager.get_all_users())
-
-    user_id = generate_user_id(users)
-    salt = secrets.token_hex(8)
-    hashed_password = hashlib.sha256((password + salt).encode()).hexdigest()
-    registration_date = datetime.utcnow().isoformat()
-
-    new_user = {
-        "user_id": user_id,
-        "username": username,
-        "hashed_password": hashed_password,
-        "salt": salt,
-        "registration_date": registration_date
-    }
-    users.append(new_user)
-    database_manager.save_users(users)
+    # Проверка уникальности имени и добавление - под одной блокировкой
+    with database_manager.locked('users'):
+        existing_user = database_manager.get_user_by_username(username)
+        if existing_user:
+            raise UserNotFoundError(f"Имя пользователя '{username}' уже занято.")
+
+        user_id = database_manager.allocate_user_id()
+        salt = secrets.token_hex(8)
+        hashed_password = hashlib.sha256((password + salt).encode()).hexdigest()
+        registration_date = datetime.utcnow().isoformat()
+
+        new_user = {
+            "user_id": user_id,
+            "username": username,
+            "hashed_password": hashed_password,
+            "salt": salt,
+            "registration_date": registration_date
+        }
+        database_manager.add_user(new_user)
 
     # Создаем портфель с начальным балансом в USD
     initial_usd_balance = Decimal("1000.00")
-    new_portfolio = {"user_id": user_id, "wallets": {BASE_CURRENCY: {'balance': str(initial_usd_balance)}}}
+    initial_wallet = make_wallet(to_units(initial_usd_balance, BASE_CURRENCY), BASE_CURRENCY)
+    new_portfolio = {"user_id": user_id, "wallets": {BASE_CURRENCY: initial_wallet}}
 
-    portfolios = database_manager.get_all_portfolios()
-    portfolios.append(new_portfolio)
-    database_manager.save_portfolios(portfolios)
+    database_manager.add_portfolio(new_portfolio)
 
     return user_id
 
@@ -82,8 +78,12 @@ def login_user(username, password):
     return user['user_id']
 
 
-def show_portfolio(user_id, base_currency=BASE_CURRENCY):
-    """Отображает портфель пользователя"""
+def show_portfolio(user_id, base_currency=BASE_CURRENCY, at=None):
+    """
+    Отображает портфель пользователя. at (ISO-строка UTC или datetime) —
+    оценить текущие балансы по курсам, действовавшим в этот момент.
+    Текущая оценка кэшируется по (user_id, base, версия курсов, версия портфеля).
+    """
     try:
         get_currency(base_currency)
     except CurrencyNotFoundError as e:
@@ -93,53 +93,79 @@ def show_portfolio(user_id, base_currency=BASE_CURRENCY):
     if not portfolio_raw:
         raise UserNotFoundError(f"Портфель для пользователя с ID {user_id} не найден.")
 
-    rates_cache = database_manager.get_rates()
+    rates = _rate_snapshot(at)
+
+    cache_key = None
+    if at is None:
+        cache_key = (user_id, base_currency, rates.version, portfolio_raw.get('version', 0))
+        cached = valuation_cache.get(cache_key)
+        if cached is not None:
+            portfolio_info, total_value = cached
+            return {curr: dict(item) for curr, item in portfolio_info.items()}, total_value
 
     total_value = Decimal('0.0')
     portfolio_info = {}
+    valid_until = float('inf')  # когда первый из использованных курсов устареет
 
     wallets = portfolio_raw.get('wallets', {})
     if wallets:
         for curr, data in wallets.items():
-            balance = data.get('balance', 0)
-            if not isinstance(balance, Decimal):
-                balance = Decimal(str(balance))
-
-            value = Decimal('0.0')
-            if curr == base_currency:
-                value = balance
-            else:
-                rate_key = f"{curr}_{base_currency}"
-                rate_info = rates_cache.get('pairs', {}).get(rate_key)
-                if rate_info:
-                    if is_rate_fresh(rate_info):
-                        try:
-                            rate_value = Decimal(rate_info['rate'])
-                            value = balance * rate_value
-                        except (ValueError, TypeError):
-                            value = Decimal('0.0')
-                    else:
-                        value = Decimal('0.0')  # Курс устарел
-                else:
-                    value = Decimal('0.0')  # Курс отсутствует
+            balance = from_units(wallet_units(data, curr), curr)
+            value, expires_at = _wallet_value(balance, curr, base_currency, rates)
+            valid_until = min(valid_until, expires_at)
 
             total_value += value
             portfolio_info[curr] = {"balance": balance, "value_in_base": value}
 
+    if cache_key is not None:
+        valuation_cache.put(cache_key, (portfolio_info, total_value), valid_until)
+        portfolio_info = {curr: dict(item) for curr, item in portfolio_info.items()}
     return portfolio_info, total_value
 
 
-@log_action(verbose=True)
-def buy_currency(user_id, currency, amount):
-    """Покупка валюты"""
-    
-    # Валидация исходных данных
-    
+def valuate_all(base_currencies=(BASE_CURRENCY,), at=None):
+    """
+    Оценивает все портфели в одной или нескольких базовых валютах за один
+    проход: портфели и курсы загружаются один раз. Возвращает итоги по
+    пользователям, общий итог и экспозицию по каждой валюте (см. valuate_portfolios).
+    at — оценить по курсам из истории на этот момент (например, на конец месяца).
+    """
+    bases = []
+    for base_currency in base_currencies:
+        base_currency = base_currency.upper()
+        try:
+            get_currency(base_currency)
+        except CurrencyNotFoundError as e:
+            raise ValidationError(f"Неизвестная базовая валюта '{base_currency}'.") from e
+        if base_currency not in bases:
+            bases.append(base_currency)
+
+    return valuate_portfolios(database_manager.get_all_portfolios(), _rate_snapshot(at), bases)
+
+
+def _wallet_value(balance, currency, base_currency, rates):
+    """
+    Стоимость баланса в базовой валюте и момент, когда использованный курс
+    устареет (inf, если курс не понадобился или не найден).
+    """
+    if currency == base_currency:
+        return balance, float('inf')
+    # Прямой курс или кросс-курс через опорную валюту
+    pair_rate = rates.get(currency, base_currency)
+    if not pair_rate:
+        return Decimal('0.0'), float('inf')  # Курс отсутствует
+    if not pair_rate.is_fresh():
+        return Decimal('0.0'), float('inf')  # Курс устарел
+    return balance * pair_rate.rate, pair_rate.expires_at
+
+
+def _parse_amount(amount):
+    """Проверяет и приводит amount к положительному Decimal."""
     # 1. Проверка типа amount
-    if not isinstance(amount, (int, float, str)):
+    if not isinstance(amount, (int, float, str, Decimal)):
         # Используем стандартное исключение для валидации, если тип данных неверен
         raise ValidationError(f"'amount' должен быть числом (int, float) или строкой. Получен тип: {type(amount).__name__}")
-    
+
     # 2. Проверка на положительное значение
     # Приводим к Decimal сразу для безопасной работы с финансовыми данными
     try:
@@ -150,130 +176,212 @@ def buy_currency(user_id, currency, amount):
 
     if amount_dec <= 0:
         raise ValidationError("'amount' должен быть положительным числом")
-    
-    currency = currency.upper()
+    return amount_dec
+
 
+def _parse_at(at):
+    """Приводит момент оценки к datetime (UTC без зоны)."""
+    if isinstance(at, datetime):
+        return at
     try:
-        get_currency(currency)
-    except CurrencyNotFoundError as e:
-        raise e
+        return datetime.fromisoformat(str(at))
+    except ValueError as e:
+        raise ValidationError(
+            f"Некорректный момент времени '{at}'. Ожидается ISO-формат, например 2026-09-01T12:00."
+        ) from e
 
-    portfolio_raw = database_manager.get_portfolio_by_user_id(user_id)
-    if not portfolio_raw:
-        raise UserNotFoundError("Портфель не найден.")
 
-    rates = database_manager.get_rates()
-    rate_key = f"{currency}_{BASE_CURRENCY}"
+def _rate_snapshot(at=None):
+    """
+    Снимок текущих курсов (разбирается один раз на каждое обновление rates.json)
+    или, если задан at, курсов из истории на этот момент.
+    """
+    if at is not None:
+        return historical_rate_snapshot(_parse_at(at), BASE_CURRENCY)
+    return rate_snapshot_for(database_manager.get_rates(), BASE_CURRENCY)
+
 
-    rate_info = rates.get('pairs', {}).get(rate_key)
+def _get_trade_rate(rates, currency):
+    """Возвращает свежий курс currency→BASE_CURRENCY из снимка курсов."""
+    pair_rate = rates.get(currency, BASE_CURRENCY)
 
     # Сначала проверяем, есть ли курс вообще
-    if not rate_info:
+    if not pair_rate:
         raise ApiRequestError(f"Курс {currency}→{BASE_CURRENCY} недоступен.")
 
     # Потом проверяем, не устарел ли он
-    if not is_rate_fresh(rate_info):
+    if not pair_rate.is_fresh():
         raise ApiRequestError(f"Курс {currency}→{BASE_CURRENCY} устарел. Обновите курсы.")
 
-    rate = Decimal(rate_info['rate'])
-    cost = amount_dec * rate # Используем amount_dec
+    return pair_rate.rate
 
-    # Автоматическое создание кошелька, если его нет
-    if 'wallets' not in portfolio_raw:
-        portfolio_raw['wallets'] = {}
-    if currency not in portfolio_raw['wallets']:
-        portfolio_raw['wallets'][currency] = {'balance': '0.0'}
-    if BASE_CURRENCY not in portfolio_raw['wallets']:
-        portfolio_raw['wallets'][BASE_CURRENCY] = {'balance': '0.0'}
 
-    usd_balance = Decimal(str(portfolio_raw['wallets'][BASE_CURRENCY]['balance']))
-    if usd_balance < cost:
+def _apply_buy(portfolio_raw, currency, amount_dec, rates):
+    """
+    Применяет покупку к портфелю в памяти. Возвращает использованный курс.
+    Балансы считаются в минимальных единицах; стоимость округляется вверх,
+    чтобы округление никогда не шло в пользу покупателя.
+    """
+    amount_units = exact_units(amount_dec, currency)
+    rate = _get_trade_rate(rates, currency)
+    cost_units = to_units(amount_dec * rate, BASE_CURRENCY, rounding=ROUND_CEILING)
+
+    wallets = portfolio_raw.setdefault('wallets', {})
+    usd_units = wallet_units(wallets.get(BASE_CURRENCY, {}), BASE_CURRENCY)
+    if usd_units < cost_units:
         raise InsufficientFundsError(
             message=f"Недостаточно {BASE_CURRENCY} для совершения покупки.",
-            available_amount=usd_balance,
-            required_amount=cost,
+            available_amount=from_units(usd_units, BASE_CURRENCY),
+            required_amount=from_units(cost_units, BASE_CURRENCY),
             currency_code=BASE_CURRENCY
         )
 
-    portfolio_raw['wallets'][BASE_CURRENCY]['balance'] = str(usd_balance - cost)
-    currency_balance = Decimal(str(portfolio_raw['wallets'][currency]['balance']))
-    portfolio_raw['wallets'][currency]['balance'] = str(currency_balance + amount_dec)
-
-    # Обновляем портфель в базе данных
-    portfolios = database_manager.get_all_portfolios()
-    for i, p in enumerate(portfolios):
-        if p['user_id'] == user_id:
-            portfolios[i] = portfolio_raw
-            break
-    database_manager.save_portfolios(portfolios)
-
-    return f"Покупка выполнена: {amount_dec:.4f} {currency} по курсу {rate:.2f} {BASE_CURRENCY}/{currency}"
-
-@log_action(verbose=True)
-def sell_currency(user_id, currency, amount):
-    """Продажа валюты."""
-    currency = currency.upper()
-
-    if amount <= 0:
-        raise ValidationError("'amount' должен быть положительным числом")
+    # Кошельки создаются автоматически, если их нет
+    wallets[BASE_CURRENCY] = make_wallet(usd_units - cost_units, BASE_CURRENCY)
+    currency_units = wallet_units(wallets.get(currency, {}), currency)
+    wallets[currency] = make_wallet(currency_units + amount_units, currency)
+    _bump_version(portfolio_raw)
+    return rate
 
-    try:
-        get_currency(currency)
-    except CurrencyNotFoundError as e:
-        raise e
-
-    portfolio_raw = database_manager.get_portfolio_by_user_id(user_id)
-    if not portfolio_raw:
-        raise UserNotFoundError("Портфель не найден.")
 
+def _apply_sell(portfolio_raw, currency, amount_dec, rates):
+    """Применяет продажу к портфелю в памяти. Возвращает использованный курс."""
     if 'wallets' not in portfolio_raw or currency not in portfolio_raw['wallets']:
         raise CurrencyNotFoundError(f"У вас нет кошелька '{currency}'. "
                                     f"Добавьте валюту: она создается автоматически при первой покупке.",
                                     code=currency)
 
-    currency_balance = Decimal(str(portfolio_raw['wallets'][currency]['balance']))
-    if currency_balance < amount:
+    wallets = portfolio_raw['wallets']
+    amount_units = exact_units(amount_dec, currency)
+    currency_units = wallet_units(wallets[currency], currency)
+    if currency_units < amount_units:
+        currency_balance = from_units(currency_units, currency)
         raise InsufficientFundsError(
             message=f"Недостаточно средств: доступно {currency_balance:.4f} {currency}, "
-                    f"требуется {amount:.4f} {currency}",
+                    f"требуется {amount_dec:.4f} {currency}",
             available_amount=currency_balance,
-            required_amount=amount,
+            required_amount=amount_dec,
             currency_code=currency
         )
 
-    rates = database_manager.get_rates()
-    rate_key = f"{currency}_{BASE_CURRENCY}"
+    rate = _get_trade_rate(rates, currency)
+    # Выручка округляется вниз, чтобы округление никогда не шло в пользу продавца
+    revenue_units = to_units(amount_dec * rate, BASE_CURRENCY, rounding=ROUND_FLOOR)
 
-    rate_info = rates.get('pairs', {}).get(rate_key)
-    if not rate_info:
-        raise ApiRequestError(f"Курс {currency}→{BASE_CURRENCY} недоступен.")
+    wallets[currency] = make_wallet(currency_units - amount_units, currency)
+    usd_units = wallet_units(wallets.get(BASE_CURRENCY, {}), BASE_CURRENCY)
+    wallets[BASE_CURRENCY] = make_wallet(usd_units + revenue_units, BASE_CURRENCY)
+    _bump_version(portfolio_raw)
+    return rate
 
-    if not is_rate_fresh(rate_info):
-        raise ApiRequestError(f"Курс {currency}→{BASE_CURRENCY} устарел. Обновите курсы.")
 
-    rate = Decimal(rate_info['rate'])
-    amount_dec = Decimal(str(amount))
-    revenue = amount_dec * rate
+def _bump_version(portfolio_raw):
+    """Увеличивает версию портфеля: кэшированные оценки до сделки перестают находиться."""
+    portfolio_raw['version'] = int(portfolio_raw.get('version', 0)) + 1
+
+
+@log_action(verbose=True)
+def buy_currency(user_id, currency, amount):
+    """Покупка валюты"""
+    amount_dec = _parse_amount(amount)
+
+    currency = currency.upper()
+
+    try:
+        get_currency(currency)
+    except CurrencyNotFoundError as e:
+        raise e
 
-    portfolio_raw['wallets'][currency]['balance'] = str(currency_balance - amount_dec)
+    # Проверка баланса и запись выполняются под одной блокировкой портфелей,
+    # чтобы параллельные процессы не потеряли изменения друг друга
+    with database_manager.locked('portfolios', [user_id]):
+        portfolio_raw = database_manager.get_portfolio_by_user_id(user_id)
+        if not portfolio_raw:
+            raise UserNotFoundError("Портфель не найден.")
 
-    if BASE_CURRENCY not in portfolio_raw['wallets']:
-        portfolio_raw['wallets'][BASE_CURRENCY] = {'balance': '0.0'}
+        rate = _apply_buy(portfolio_raw, currency, amount_dec, _rate_snapshot())
 
-    usd_balance = Decimal(str(portfolio_raw['wallets'][BASE_CURRENCY]['balance']))
-    portfolio_raw['wallets'][BASE_CURRENCY]['balance'] = str(usd_balance + revenue)
+        # Обновляем портфель в базе данных
+        database_manager.update_portfolio(portfolio_raw)
 
-    # Обновляем портфель в базе данных
-    portfolios = database_manager.get_all_portfolios()
-    for i, p in enumerate(portfolios):
-        if p['user_id'] == user_id:
-            portfolios[i] = portfolio_raw
-            break
-    database_manager.save_portfolios(portfolios)
+    return f"Покупка выполнена: {amount_dec:.4f} {currency} по курсу {rate:.2f} {BASE_CURRENCY}/{currency}"
+
+@log_action(verbose=True)
+def sell_currency(user_id, currency, amount):
+    """Продажа валюты."""
+    amount_dec = _parse_amount(amount)
+
+    currency = currency.upper()
+
+    try:
+        get_currency(currency)
+    except CurrencyNotFoundError as e:
+        raise e
+
+    # Проверка баланса и запись выполняются под одной блокировкой портфелей,
+    # чтобы параллельные процессы не потеряли изменения друг друга
+    with database_manager.locked('portfolios', [user_id]):
+        portfolio_raw = database_manager.get_portfolio_by_user_id(user_id)
+        if not portfolio_raw:
+            raise UserNotFoundError("Портфель не найден.")
+
+        rate = _apply_sell(portfolio_raw, currency, amount_dec, _rate_snapshot())
+
+        # Обновляем портфель в базе данных
+        database_manager.update_portfolio(portfolio_raw)
 
     return f"Продажа выполнена: {amount_dec:.4f} {currency} по курсу {rate:.2f} {BASE_CURRENCY}/{currency}"
 
 
+@log_action()
+def execute_batch(orders):
+    """
+    Исполняет пакет заявок [{"user_id", "action": "buy"|"sell", "currency", "amount"}, ...]
+    по тем же правилам, что buy_currency/sell_currency. Портфели и курсы
+    загружаются один раз, все изменения сохраняются одной записью.
+    Возвращает список результатов по каждой заявке в исходном порядке.
+    """
+    appliers = {"buy": _apply_buy, "sell": _apply_sell}
+    results = []
+    touched = {}
+
+    # Блокируются портфели (в раскладке sharded — шарды) всех пользователей пакета
+    with database_manager.locked('portfolios', [order.get('user_id') for order in orders]):
+        rates = _rate_snapshot()
+
+        for index, order in enumerate(orders):
+            try:
+                action = str(order.get('action', '')).lower()
+                if action not in appliers:
+                    raise ValidationError(f"Неизвестное действие '{order.get('action')}'. Допустимо: buy, sell.")
+                amount_dec = _parse_amount(order.get('amount'))
+                currency = str(order.get('currency', '')).upper()
+                get_currency(currency)
+
+                user_id = order.get('user_id')
+                portfolio_raw = touched.get(user_id)
+                if portfolio_raw is None:
+                    portfolio_raw = database_manager.get_portfolio_by_user_id(user_id)
+                    if not portfolio_raw:
+                        raise UserNotFoundError(f"Портфель для пользователя с ID {user_id} не найден.")
+
+                # Применяем к копии, чтобы неудачная заявка не оставила следов в портфеле
+                candidate = copy.deepcopy(portfolio_raw)
+                rate = appliers[action](candidate, currency, amount_dec, rates)
+                touched[user_id] = candidate
+                results.append({"index": index, "status": "OK", "user_id": user_id, "action": action,
+                                "currency": currency, "amount": amount_dec, "rate": rate})
+            except (ValidationError, UserNotFoundError, CurrencyNotFoundError,
+                    InsufficientFundsError, ApiRequestError) as e:
+                results.append({"index": index, "status": "ERROR", "user_id": order.get('user_id'),
+                                "error_type": type(e).__name__, "error_message": str(e)})
+
+        if touched:
+            database_manager.update_portfolios(list(touched.values()))
+
+    return results
+
+
 def get_rate(from_currency, to_currency):
     """Получает курс обмена валют."""
     from_currency = from_currency.upper()
@@ -285,26 +393,36 @@ def get_rate(from_currency, to_currency):
     except CurrencyNotFoundError as e:
         raise e
 
-    rates_data_from_manager = database_manager.get_rates()
-    rate_key = f"{from_currency}_{to_currency}"
-
-    rate_info = rates_data_from_manager.get('pairs', {}).get(rate_key)
+    # Пары вида X_USD дают любые кросс-курсы через опорную валюту
+    pair_rate = _rate_snapshot().get(from_currency, to_currency)
 
-    if not rate_info:
+    if not pair_rate:
         raise ApiRequestError("Данные о курсе недоступны.")
 
-    if not is_rate_fresh(rate_info):
+    if not pair_rate.is_fresh():
         raise ApiRequestError("Данные о курсе устарели. Выполните 'update-rates'.")
 
-    rate_value = Decimal(rate_info['rate'])
-    return f"Курс {from_currency}→{to_currency}: {rate_value:.8f} (обновлено: {rate_info['updated_at'][:19]})"
+    if pair_rate.updated_at is None:  # from == to
+        return f"Курс {from_currency}→{to_currency}: {pair_rate.rate:.8f}"
+    return f"Курс {from_currency}→{to_currency}: {pair_rate.rate:.8f} (обновлено: {pair_rate.updated_at[:19]})"
 
 
 def is_rate_fresh(rate_info):
-    """Проверяет, не устарел ли курс."""
+    """Проверяет, не устарел ли курс (PairRate из снимка или запись из rates.json)."""
+    if isinstance(rate_info, PairRate):
+        return rate_info.is_fresh()
     if not rate_info or 'updated_at' not in rate_info:
         return False
 
     updated_at_str = rate_info['updated_at']
     updated_at_dt = datetime.fromisoformat(updated_at_str)
     return (datetime.utcnow() - updated_at_dt) <= timedelta(seconds=RATE_TTL_SECONDS)
+
+
+def search_currency(query, limit=10):
+    """Поиск валют справочника по коду или названию (для подсказок в CLI)."""
+    if not query or not query.strip():
+        raise ValidationError("Строка поиска не может быть пустой.")
+    if limit <= 0:
+        raise ValidationError("'limit' должен быть положительным числом")
+    return search_currencies(query, limit)
@@ -0,0 +1,167 @@
+# valutatrade_hub/core/valuation.py
+import threading
+import time
+from collections import OrderedDict
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from ..infra.settings import settings_loader
+from .money import from_units, scale_of, wallet_units
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен: без него расчет идет построчно в Decimal
+    np = None
+
+
+def _round(value: Decimal, base: str) -> Decimal:
+    """Стоимость в валюте base с точностью до ее минимальной единицы."""
+    return value.quantize(Decimal(1).scaleb(-scale_of(base)), rounding=ROUND_HALF_EVEN)
+
+
+def _to_decimal(value, base: str) -> Decimal:
+    return _round(Decimal(repr(float(value))), base)
+
+
+def rate_matrix(rates, codes, bases):
+    """
+    Курсы currencies × bases из RateSnapshot. Отсутствующие и устаревшие
+    курсы дают 0 (как в show_portfolio) и перечисляются во втором значении.
+    """
+    matrix = []
+    unavailable = []
+    for code in codes:
+        row = []
+        for base in bases:
+            pair_rate = rates.get(code, base)
+            if pair_rate is None or not pair_rate.is_fresh():
+                unavailable.append(f"{code}_{base}")
+                row.append(Decimal(0))
+            else:
+                row.append(pair_rate.rate)
+        matrix.append(row)
+    return matrix, unavailable
+
+
+def valuate_portfolios(portfolios, rates, bases):
+    """
+    Оценивает все портфели за один проход: балансы складываются в матрицу
+    users × currencies и умножаются на матрицу курсов currencies × bases.
+
+    Возвращает {"bases", "users": [{"user_id", "totals": {base: Decimal}}],
+    "totals": {base: Decimal}, "exposure": {currency: {"balance", "value": {base: Decimal}}},
+    "unavailable_rates": ["FROM_TO", ...]}. Балансы берутся в минимальных
+    единицах: с numpy они складываются в int64-матрицу (экспозиция точная),
+    а стоимость считается в float64. В обоих режимах стоимости округляются
+    до минимальной единицы валюты base; общий итог равен сумме округленных
+    итогов пользователей, а стоимости экспозиции округляются независимо и
+    в сумме могут отличаться от него на единицы округления.
+    """
+    codes = sorted({code for portfolio in portfolios for code in portfolio.get('wallets', {})})
+    column = {code: j for j, code in enumerate(codes)}
+    rates_by_code, unavailable = rate_matrix(rates, codes, bases)
+
+    if np is not None:
+        units = np.zeros((len(portfolios), len(codes)), dtype=np.int64)
+        for i, portfolio in enumerate(portfolios):
+            for code, wallet in portfolio.get('wallets', {}).items():
+                units[i, column[code]] = wallet_units(wallet, code)
+        # Курс за одну минимальную единицу: rate * 10^-scale
+        unit_scale = np.array([10.0 ** -scale_of(code) for code in codes])
+        rate_array = np.array([[float(rate) for rate in row] for row in rates_by_code]).reshape(len(codes), len(bases))
+        unit_rates = rate_array * unit_scale[:, None]
+
+        user_totals = units @ unit_rates  # users × bases
+        exposure_units = units.sum(axis=0)  # currencies, точно в int64
+        exposure_value = exposure_units[:, None] * unit_rates  # currencies × bases
+
+        users = [{"user_id": portfolio.get('user_id'),
+                  "totals": {base: _to_decimal(user_totals[i, k], base) for k, base in enumerate(bases)}}
+                 for i, portfolio in enumerate(portfolios)]
+        exposure = {code: {"balance": from_units(int(exposure_units[j]), code),
+                           "value": {base: _to_decimal(exposure_value[j, k], base) for k, base in enumerate(bases)}}
+                    for j, code in enumerate(codes)}
+    else:
+        users = []
+        exposure_units = [0] * len(codes)
+        for portfolio in portfolios:
+            row_totals = [Decimal(0)] * len(bases)
+            for code, wallet in portfolio.get('wallets', {}).items():
+                j = column[code]
+                wallet_balance = wallet_units(wallet, code)
+                exposure_units[j] += wallet_balance
+                balance = from_units(wallet_balance, code)
+                for k, rate in enumerate(rates_by_code[j]):
+                    row_totals[k] += balance * rate
+            users.append({"user_id": portfolio.get('user_id'),
+                          "totals": {base: _round(total, base) for base, total in zip(bases, row_totals, strict=True)}})
+        exposure_balance = [from_units(total, code) for code, total in zip(codes, exposure_units, strict=True)]
+        exposure_value = [[exposure_balance[j] * rate for rate in rates_by_code[j]] for j in range(len(codes))]
+        exposure = {code: {"balance": exposure_balance[j],
+                           "value": {base: _round(exposure_value[j][k], base) for k, base in enumerate(bases)}}
+                    for j, code in enumerate(codes)}
+
+    # Общий итог — сумма уже округленных итогов пользователей, чтобы отчет сходился построчно
+    totals = {base: _round(sum((user['totals'][base] for user in users), Decimal(0)), base) for base in bases}
+
+    return {"bases": list(bases), "users": users, "totals": totals,
+            "exposure": exposure, "unavailable_rates": unavailable}
+
+
+class ValuationCache:
+    """
+    LRU-кэш оценок портфелей по ключу (user_id, base, версия курсов, версия портфеля).
+
+    Обновление курсов и сделка меняют соответствующую версию, поэтому старые
+    записи просто перестают находиться и вытесняются LRU. Запись также живет
+    не дольше, чем самый ранний из использованных курсов остается свежим:
+    после этого оценка пересчитывается (устаревший курс дает 0). Массовая
+    перезапись портфелей (миграция, решардинг) версий не меняет, поэтому
+    после нее кэш сбрасывается через invalidate().
+    max_size=0 отключает кэш.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # ключ -> (значение, valid_until)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now=None):
+        """Значение по ключу или None, если его нет или оно пережило valid_until."""
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (time.time() if now is None else now) > entry[1]:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, valid_until=float('inf')):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, valid_until)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """Сбрасывает записи одного пользователя или весь кэш."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+valuation_cache = ValuationCache(settings_loader.get('valuation_cache_size', 1024))
@@ -0,0 +1,149 @@
+# valutatrade_hub/infra/candles.py
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+from .locking import file_lock
+from .timeseries import from_epoch_us, from_fixed, to_epoch_us, to_fixed
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Интервал свечи -> длительность в микросекундах
+INTERVALS = {"1m": 60 * 1_000_000, "1h": 3600 * 1_000_000, "1d": 86400 * 1_000_000}
+
+# Свеча: начало интервала (мкс epoch), open, high, low, close (×RATE_SCALE), число тиков
+_CANDLE = struct.Struct("<qqqqqq")
+_FIELDS = 6
+
+
+class CandleStore:
+    """
+    OHLC-свечи 1m/1h/1d по каждой паре, обновляемые инкрементально при
+    сохранении курсов. Файл <PAIR>_<interval>.ohlc — записи фиксированной
+    длины, отсортированные по началу интервала: новый тик либо
+    перезаписывает последнюю свечу, либо дописывает новую. Выборка по
+    времени — бинарный поиск по файлу, отображенному в память.
+    """
+
+    def __init__(self, dir_path=None):
+        self.dir_path = dir_path or os.path.join(BASE_DIR, "data", "history", "candles")
+
+    def _path(self, pair, interval):
+        return os.path.join(self.dir_path, f"{pair}_{interval}.ohlc")
+
+    # --- Запись ---
+    def update(self, rates_map, timestamp):
+        """Учитывает тики {пара: курс} момента timestamp во всех интервалах."""
+        os.makedirs(self.dir_path, exist_ok=True)
+        ts_us = to_epoch_us(timestamp)
+        for pair, rate in rates_map.items():
+            fixed = to_fixed(rate)
+            for interval, length in INTERVALS.items():
+                self._add_tick(self._path(pair, interval), ts_us - ts_us % length, fixed)
+
+    def _add_tick(self, path, bucket, rate):
+        with file_lock(path, exclusive=True):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                if size % _CANDLE.size:
+                    # Прерванная запись: отбрасываем неполную свечу
+                    size -= size % _CANDLE.size
+                    os.ftruncate(fd, size)
+
+                last = list(_CANDLE.unpack(os.pread(fd, _CANDLE.size, size - _CANDLE.size))) if size else None
+                if last is not None and last[0] == bucket:
+                    # Тик в текущем интервале: последняя свеча перезаписывается на месте
+                    last[2] = max(last[2], rate)
+                    last[3] = min(last[3], rate)
+                    last[4] = rate
+                    last[5] += 1
+                    os.pwrite(fd, _CANDLE.pack(*last), size - _CANDLE.size)
+                elif last is None or last[0] < bucket:
+                    os.pwrite(fd, _CANDLE.pack(bucket, rate, rate, rate, rate, 1), size)
+                # Тики из уже закрытых интервалов (пришли не по порядку) пропускаются
+            finally:
+                os.close(fd)
+
+    def rebuild(self, records):
+        """
+        Пересобирает свечи из записей истории (dict с from_currency,
+        to_currency, rate, timestamp). Возвращает число свечей по интервалам.
+        """
+        ticks = {}
+        for record in records:
+            pair = f"{record['from_currency']}_{record['to_currency']}"
+            ticks.setdefault(pair, []).append((to_epoch_us(record['timestamp']), to_fixed(record['rate'])))
+
+        os.makedirs(self.dir_path, exist_ok=True)
+        counts = dict.fromkeys(INTERVALS, 0)
+        for pair, pair_ticks in ticks.items():
+            pair_ticks.sort()
+            for interval, length in INTERVALS.items():
+                candles = []
+                for ts_us, rate in pair_ticks:
+                    bucket = ts_us - ts_us % length
+                    if candles and candles[-1][0] == bucket:
+                        candle = candles[-1]
+                        candle[2] = max(candle[2], rate)
+                        candle[3] = min(candle[3], rate)
+                        candle[4] = rate
+                        candle[5] += 1
+                    else:
+                        candles.append([bucket, rate, rate, rate, rate, 1])
+                path = self._path(pair, interval)
+                with file_lock(path, exclusive=True):
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(b"".join(_CANDLE.pack(*candle) for candle in candles))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+                counts[interval] += len(candles)
+        return counts
+
+    # --- Чтение ---
+    def candles(self, pair, interval, start=None, end=None, limit=None):
+        """
+        Свечи пары с началом интервала в [start, end] (ISO-строки, datetime или
+        мкс epoch; start округляется вниз до начала интервала). limit — только
+        последние N. Возвращает список dict: start, open, high, low, close (Decimal), count.
+        """
+        if interval not in INTERVALS:
+            raise ValueError(f"Неизвестный интервал '{interval}'. Допустимо: {', '.join(INTERVALS)}.")
+        try:
+            f = open(self._path(pair, interval), "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            size = os.fstat(f.fileno()).st_size // _CANDLE.size * _CANDLE.size
+            if size == 0:
+                return []
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+                values = memoryview(mapped).cast('q')
+                try:
+                    count = len(values) // _FIELDS
+                    starts = values[0::_FIELDS]
+                    length = INTERVALS[interval]
+                    lo = 0
+                    if start is not None:
+                        start_us = to_epoch_us(start)
+                        lo = bisect_left(starts, start_us - start_us % length)
+                    hi = count if end is None else bisect_right(starts, to_epoch_us(end))
+                    if limit is not None:
+                        lo = max(lo, hi - limit)
+                    result = []
+                    for i in range(lo, hi):
+                        bucket, open_, high, low, close, ticks = values[i * _FIELDS:(i + 1) * _FIELDS]
+                        result.append({"start": from_epoch_us(bucket), "open": from_fixed(open_),
+                                       "high": from_fixed(high), "low": from_fixed(low),
+                                       "close": from_fixed(close), "count": ticks})
+                    return result
+                finally:
+                    del starts
+                    values.release()
+
+
+candles = CandleStore()
@@ -1,11 +1,25 @@
 # valutatrade_hub/infra/database.py
+import atexit
+import copy
 import json
+import logging
 import os
+import tempfile
+from contextlib import ExitStack, contextmanager
 from decimal import Decimal
 from pathlib import Path
 
+from .group_commit import GroupCommit
+from .history_store import SegmentedHistoryStore
+from .locking import file_lock, try_file_lock
+from .portfolio_log import PortfolioLog, apply_record, fsync_dir, make_record
+from .record_index import dump_list, lookup, record_key, write_index
+from .settings import settings_loader
+
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
+logger = logging.getLogger(__name__)
+
 
 class DatabaseManager:
     """
@@ -26,69 +40,687 @@ class DatabaseManager:
         self.rates_file = os.path.join(BASE_DIR, "data", "rates.json")
         # Новый файл, который будет использовать Parser Service
         self.exchange_rates_history_file = os.path.join(BASE_DIR, "data", "exchange_rates.json")
+        # Append-only сегменты истории (новые записи пишутся только сюда)
+        self.history_dir = os.path.join(BASE_DIR, "data", "history")
+        self._history_store = SegmentedHistoryStore(
+            self.history_dir, settings_loader.get('history_segment_max_bytes', 8 * 1024 * 1024))
+        # Раскладка портфелей: 'single' (один portfolios.json) или 'sharded'
+        # (N файлов-шардов по user_id в data/portfolios/, N хранится в манифесте)
+        self.portfolio_shards_dir = os.path.join(BASE_DIR, "data", "portfolios")
+        self.shard_manifest_file = os.path.join(self.portfolio_shards_dir, "manifest.json")
+        self._sharded = settings_loader.get('portfolio_layout', 'single') == 'sharded'
+        self._default_shard_count = settings_loader.get('portfolio_shards', 16)
+        self._shard_manifest_entry = None  # (сигнатура, манифест)
+        self._shard_indexes = {}  # путь шарда -> (список из кэша, индекс user_id -> portfolio)
+        # Служебные данные хранилища (счетчик user_id и т.п.)
+        self.meta_file = os.path.join(BASE_DIR, "data", "meta.json")
+        # Журнал изменений портфелей (режим write-ahead log)
+        self.portfolios_log_file = os.path.join(BASE_DIR, "data", "portfolios.log")
+        # Файлы-списки с sidecar-индексом смещений (<file>.idx): файл -> поле-ключ
+        self._record_index_keys = {
+            self.users_file: 'username',
+            self.portfolios_file: 'user_id',
+        }
+        # Файлы, на которых берутся блокировки для read-modify-write
+        self._lock_paths = {
+            "users": self.users_file,
+            "portfolios": self.portfolios_file,
+            "rates": self.rates_file,
+            "meta": self.meta_file,
+        }
 
-    def _load_json(self, file_path):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                if content:
-                    return json.loads(content)
-                else:
-                    return []  #  Возвращаем пустой список, если файл пуст
-        except FileNotFoundError:
-            return []  #  Возвращаем пустой список, если файл не найден
-        except json.JSONDecodeError:
-            return []  #  Возвращаем пустой список, если ошибка декодирования JSON
+        # Кэш разобранных документов: путь -> (сигнатура файла, данные).
+        # Сигнатура (mtime, size, inode) позволяет увидеть запись другого процесса.
+        self._cache = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # Хеш-индексы: строятся один раз при первом обращении и поддерживаются при записи
+        self._users = None
+        self._users_by_name = None
+        self._portfolios = None
+        self._portfolios_by_user_id = None
+
+        # Режим журнала: сделки дописываются в portfolios.log, снимок обновляется компакцией
+        self._portfolio_log = None
+        if settings_loader.get('portfolio_log_enabled', False):
+            if self._sharded:
+                logger.warning("portfolio_log_enabled is ignored for the sharded portfolio layout")
+            else:
+                self._portfolio_log = PortfolioLog(self.portfolios_log_file)
+        self._log_compact_threshold = settings_loader.get('portfolio_log_compact_threshold', 1000)
+        self._log_base = None  # снимок, на который накатывается журнал
+        self._log_inode = None
+        self._log_offset = 0
+        self._log_records = 0
+
+        # Групповая фиксация: сделки копятся в памяти и журнале намерений,
+        # portfolios.json перезаписывается одной записью на пачку
+        self.portfolios_intent_file = os.path.join(BASE_DIR, "data", "portfolios.intent.log")
+        self._group_commit = None
+        self._group_commit_state = None  # None — еще не открывалась, True/False — результат
+        self._recovering_intents = False
+        if settings_loader.get('group_commit_enabled', False):
+            self._group_commit = GroupCommit(
+                self.portfolios_intent_file, self._store_portfolios, self._portfolio_lock_paths,
+                interval=settings_loader.get('group_commit_interval_ms', 200) / 1000,
+                max_pending=settings_loader.get('group_commit_max_pending', 100),
+                sync=settings_loader.get('group_commit_fsync', True))
 
     def _save_json(self, data, file_path):
+        """
+        Запись под исключительной блокировкой: временный файл, fsync и атомарное
+        переименование. Читатель видит либо старую, либо новую версию файла целиком.
+        """
         def default(obj):
             if isinstance(obj, Decimal):
                 return str(obj)
             raise TypeError
 
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, default=default)
+        dir_path = os.path.dirname(file_path)
+        with file_lock(file_path, exclusive=True):
+            fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+            try:
+                key_field = self._index_key_field(file_path)
+                entries = None
+                with os.fdopen(fd, "wb") as f:
+                    if key_field is not None:
+                        # Список пишется поэлементно, чтобы запомнить смещение каждой записи
+                        payload, entries = dump_list(data, key_field, default=default)
+                    else:
+                        payload = json.dumps(data, indent=4, default=default).encode("utf-8")
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            fsync_dir(dir_path)
+            if entries is not None:
+                write_index(f"{file_path}.idx", file_path, entries)
+
+            # Write-through: сохраненные данные сразу становятся содержимым кэша
+            self._cache[file_path] = (self._file_signature(file_path), data)
+
+    def _index_key_field(self, file_path):
+        """Поле-ключ sidecar-индекса для файла-списка (None, если индекс не ведется)."""
+        key_field = self._record_index_keys.get(file_path)
+        if key_field is None and self._is_shard_file(file_path):
+            return 'user_id'
+        return key_field
+
+    @contextmanager
+    def locked(self, name, keys=None):
+        """
+        Исключительная блокировка хранилища name ('users', 'portfolios', 'rates', 'meta')
+        на время read-modify-write, чтобы параллельные процессы не перезаписали
+        изменения друг друга. keys — user_id, которые затрагивает операция:
+        в раскладке sharded блокируются только их шарды.
+        """
+        if name == 'portfolios' and self._group_commit_open():
+            # Сделки меняют только буфер, но файлы портфелей остаются
+            # заблокированными для других процессов до сброса буфера
+            with self._group_commit.lock:
+                self._group_commit.hold()
+                try:
+                    yield
+                finally:
+                    self._group_commit.release_if_idle()
+            return
+        with self._locked_files(name, keys):
+            yield
+
+    @contextmanager
+    def _locked_files(self, name, keys=None):
+        """Файловая блокировка хранилища name (без учета групповой фиксации)."""
+        if name == 'portfolios' and self._sharded:
+            with self._shard_locks(keys):
+                self._recover_intent_log()
+                yield
+            return
+        with file_lock(self._lock_paths[name], exclusive=True):
+            if name == 'portfolios':
+                self._recover_intent_log()
+            yield
+
+    def _portfolio_lock_paths(self):
+        """Файлы, блокировка которых закрывает все хранилище портфелей."""
+        if self._sharded:
+            return [self.shard_manifest_file, *self._shard_paths(self._shard_manifest())]
+        return [self.portfolios_file]
+
+    # --- Кэш документов ---
+    @staticmethod
+    def _file_signature(file_path):
+        """Сигнатура файла для проверки актуальности кэша (None, если файла нет)."""
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load_cached(self, file_path, default_value):
+        """
+        Возвращает разобранный документ из кэша, перечитывая файл только
+        если изменилась его сигнатура. Возвращаемый объект общий для всех
+        читателей: изменять его можно только с последующим save_*.
+        """
+        signature = self._file_signature(file_path)
+        entry = self._cache.get(file_path)
+        if entry is not None and entry[0] == signature:
+            self._cache_hits += 1
+            return entry[1]
+
+        self._cache_misses += 1
+        with file_lock(file_path):
+            signature, data = self._read_json(file_path, default_value)
+        self._cache[file_path] = (signature, data)
+        return data
+
+    def _read_json(self, file_path, default_value):
+        """
+        Читает документ и возвращает (сигнатура прочитанного файла, данные).
+        Отсутствующий или пустой файл дает default_value; поврежденный файл —
+        ошибку, а не пустое хранилище, которое затем перезапишет все данные.
+        """
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                stat = os.fstat(f.fileno())
+                content = f.read()
+        except FileNotFoundError:
+            return None, copy.deepcopy(default_value)
+
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if not content:
+            return signature, copy.deepcopy(default_value)
+        try:
+            return signature, json.loads(content)
+        except json.JSONDecodeError:
+            logger.error("Corrupted JSON store: %s", file_path)
+            raise
+
+    def _is_warm(self, file_path):
+        """True, если в кэше актуальная версия файла."""
+        entry = self._cache.get(file_path)
+        return entry is not None and entry[0] == self._file_signature(file_path)
+
+    def _lookup_record(self, file_path, value):
+        """
+        Точечное чтение одного элемента списка через sidecar-индекс без разбора
+        всего файла. Возвращает (True, элемент или None) или (False, None),
+        если индекса нет или он устарел.
+        """
+        with file_lock(file_path):
+            return lookup(f"{file_path}.idx", file_path, self._index_key_field(file_path), value)
+
+    def cache_stats(self):
+        """Счетчики попаданий и промахов кэша документов."""
+        return {"hits": self._cache_hits, "misses": self._cache_misses, "documents": len(self._cache)}
+
+    def invalidate_cache(self):
+        """Сбрасывает кэш документов и индексы (следующее чтение пойдет в файл)."""
+        self._cache.clear()
+        self._users = None
+        self._users_by_name = None
+        self._portfolios = None
+        self._portfolios_by_user_id = None
+        self._shard_manifest_entry = None
+        self._shard_indexes.clear()
+
+    # --- Индексы ---
+    def _user_index(self):
+        """Возвращает индекс username -> user, перестраивая его при смене документа в кэше."""
+        users = self.get_all_users()
+        if users is not self._users:
+            self._reindex_users(users)
+        return self._users_by_name
+
+    def _reindex_users(self, users):
+        self._users = users
+        self._users_by_name = {user.get('username'): user for user in users}
+
+    def _portfolio_index(self):
+        """Возвращает индекс user_id -> portfolio, перестраивая его при смене документа в кэше."""
+        return self._ensure_portfolio_index(self._load_portfolios())
+
+    def _ensure_portfolio_index(self, portfolios):
+        if portfolios is not self._portfolios:
+            self._reindex_portfolios(portfolios)
+        return self._portfolios_by_user_id
+
+    def _reindex_portfolios(self, portfolios):
+        self._portfolios = portfolios
+        self._portfolios_by_user_id = {portfolio.get('user_id'): portfolio for portfolio in portfolios}
 
     # --- Методы для Core Service (пока используют те же названия, что и раньше) ---
     def get_all_users(self):
-        return self._load_json(self.users_file)  # Используем _load_json напрямую
+        return self._load_cached(self.users_file, [])
 
     def save_users(self, users):
         self._save_json(users, self.users_file)
+        self._reindex_users(users)
 
     def get_user_by_username(self, username):
-        users = self.get_all_users()
-        for user in users:
-            if user.get('username') == username:
+        if not self._is_warm(self.users_file):
+            # Холодный старт (например, разовый запуск CLI): читаем одну запись по индексу
+            found, user = self._lookup_record(self.users_file, username)
+            if found:
                 return user
-        return None
+        return self._user_index().get(username)
+
+    def add_user(self, user):
+        """Добавляет нового пользователя и обновляет индекс."""
+        with self.locked('users'):
+            # Под блокировкой индекс перечитывается, если файл менял другой процесс
+            index = self._user_index()
+            self._users.append(user)
+            self._save_json(self._users, self.users_file)
+            index[user['username']] = user
+
+    def allocate_user_id(self):
+        """
+        Выдает следующий свободный user_id по сохраненному счетчику.
+        Если счетчика еще нет, он один раз вычисляется по users.json.
+        """
+        with self.locked('meta'):
+            meta = self.load_or_default(self.meta_file, {})
+            next_id = meta.get('next_user_id')
+            if next_id is None:
+                next_id = max((user['user_id'] for user in self._user_index().values()), default=0) + 1
+            meta['next_user_id'] = next_id + 1
+            self._save_json(meta, self.meta_file)
+        return next_id
 
     def get_all_portfolios(self):
-        return self.load_or_default(self.portfolios_file, [])
+        portfolios = self._load_portfolios()
+        if self._group_commit_open():
+            return self._group_commit.overlay(portfolios)
+        return portfolios
+
+    def _load_portfolios(self):
+        """Портфели в том виде, в каком они сохранены (без буфера групповой фиксации)."""
+        if self._sharded:
+            return self._load_sharded_portfolios()
+        if self._portfolio_log is None:
+            return self._load_cached(self.portfolios_file, [])
+        # Снимок и журнал читаются под одной разделяемой блокировкой,
+        # чтобы компакция другого процесса не разорвала их согласованность
+        with file_lock(self.portfolios_file):
+            return self._apply_portfolio_log(self._load_cached(self.portfolios_file, []))
 
     def save_portfolios(self, portfolios):
-        self._save_json(portfolios, self.portfolios_file)
+        self.flush()
+        if self._sharded:
+            with self._locked_files('portfolios'):
+                manifest = self._shard_manifest()
+                self._write_shards(portfolios, manifest['shards'], manifest['generation'])
+            return
+        with self._locked_files('portfolios'):
+            self._save_json(portfolios, self.portfolios_file)
+            if self._portfolio_log is not None:
+                self._portfolio_log.reset()
+                self._rebase_portfolio_log(portfolios)
+        self._reindex_portfolios(portfolios)
 
     def get_portfolio_by_user_id(self, user_id):
-        portfolios = self.get_all_portfolios()
+        """
+        Возвращает копию портфеля: вызывающий код может менять ее
+        без риска испортить индекс до сохранения.
+        """
+        if self._group_commit_open():
+            portfolio = self._group_commit.get(user_id)
+            if portfolio is not None:
+                return portfolio
+        return self._load_portfolio(user_id)
+
+    def _load_portfolio(self, user_id):
+        if self._sharded:
+            return self._get_sharded_portfolio(user_id)
+        if not self._is_warm(self.portfolios_file):
+            # Холодный старт: одна запись снимка по индексу плюс ее записи из журнала
+            with file_lock(self.portfolios_file):
+                found, portfolio = self._lookup_record(self.portfolios_file, user_id)
+                if found:
+                    if self._portfolio_log is not None:
+                        for record in self._portfolio_log.records_for(user_id):
+                            if portfolio is None:
+                                portfolio = {"user_id": user_id, "wallets": {}}
+                            apply_record(portfolio, record)
+                    return portfolio
+
+        portfolio = self._portfolio_index().get(user_id)
+        return copy.deepcopy(portfolio) if portfolio is not None else None
+
+    def add_portfolio(self, portfolio):
+        """Добавляет новый портфель и обновляет индекс."""
+        self.update_portfolios([portfolio])
+
+    def update_portfolio(self, portfolio):
+        """Заменяет портфель пользователя (поиск по индексу, а не перебором списка)."""
+        self.update_portfolios([portfolio])
+
+    def update_portfolios(self, portfolios):
+        """
+        Сохраняет изменения нескольких портфелей одной записью: одна перезапись
+        portfolios.json (или каждого затронутого шарда) либо одно дописывание
+        в журнал для всего пакета. В режиме групповой фиксации портфели
+        попадают в буфер и сохраняются при следующем сбросе.
+        """
+        if self._group_commit_open():
+            with self.locked('portfolios'):
+                self._group_commit.stage(portfolios, self._load_portfolio)
+            return
+        self._store_portfolios(portfolios)
+
+    def _store_portfolios(self, portfolios):
+        if self._sharded:
+            self._update_sharded_portfolios(portfolios)
+            return
+        with self._locked_files('portfolios'):
+            # Под блокировкой индекс перечитывается, если файл менял другой процесс
+            index = self._portfolio_index()
+
+            if self._portfolio_log is not None:
+                records = [make_record(index.get(portfolio['user_id']), portfolio) for portfolio in portfolios]
+                records = [record for record in records if record is not None]
+                if not records:
+                    return
+                self._portfolio_log.append_many(records)
+                # Накатываем хвост журнала (включая только что записанные записи)
+                self._load_portfolios()
+                if self._log_records >= self._log_compact_threshold:
+                    self.compact_portfolio_log()
+                return
+
+            self._merge_portfolios(self._portfolios, index, portfolios)
+            self._save_json(self._portfolios, self.portfolios_file)
+
+    @staticmethod
+    def _merge_portfolios(target, index, portfolios):
+        """Вносит портфели в список target и его индекс user_id -> portfolio."""
+        for portfolio in portfolios:
+            current = index.get(portfolio['user_id'])
+            if current is None:
+                target.append(portfolio)
+                index[portfolio['user_id']] = portfolio
+            else:
+                # Обновляем запись на месте, чтобы список и индекс ссылались на один объект
+                current.clear()
+                current.update(portfolio)
+
+    # --- Групповая фиксация ---
+    def _group_commit_open(self):
+        """
+        True, если групповая фиксация включена и журнал намерений захвачен этим
+        процессом. Журнал открывается при первом обращении к портфелям; если его
+        держит другой процесс, изменения пишутся сразу, без буфера.
+        """
+        if self._group_commit is None:
+            return False
+        if self._group_commit_state is None:
+            self._group_commit_state = False
+            # Журнал упавшей сессии накатывается под блокировкой хранилища
+            with self._locked_files('portfolios'):
+                opened = self._group_commit.open(self._load_portfolio)
+            if opened:
+                atexit.register(self.flush)
+            else:
+                logger.warning("Group commit is disabled: %s is held by another process",
+                               self.portfolios_intent_file)
+            self._group_commit_state = opened
+        return self._group_commit_state
+
+    def _recover_intent_log(self):
+        """
+        Вызывается под блокировкой хранилища портфелей. Если журнал намерений
+        не пуст и его не держит живой процесс (владелец упал), изменения из
+        него накатываются до любой другой записи в хранилище.
+        """
+        if self._group_commit is None or self._group_commit_state or self._recovering_intents:
+            return
+        try:
+            if os.path.getsize(self.portfolios_intent_file) == 0:
+                return
+        except FileNotFoundError:
+            return
+        with try_file_lock(self.portfolios_intent_file) as orphaned:
+            if orphaned:
+                self._recovering_intents = True
+                try:
+                    self._group_commit.recover(self._load_portfolio)
+                finally:
+                    self._recovering_intents = False
+
+    def flush(self):
+        """Сбрасывает буфер групповой фиксации в хранилище (без него — ничего не делает)."""
+        if self._group_commit is None or not self._group_commit_state:
+            return 0
+        return self._group_commit.flush()
+
+    # --- Шарды портфелей ---
+    def _is_shard_file(self, file_path):
+        name = os.path.basename(file_path)
+        return (os.path.dirname(file_path) == self.portfolio_shards_dir
+                and name.startswith("shard_") and name.endswith(".json"))
+
+    def _shard_manifest(self):
+        """
+        Манифест шардов {"shards": N, "generation": G}. Манифест заменяется
+        атомарно, поэтому читается без блокировки (ее держит решардинг, пока
+        ждет блокировки шардов). При первом запуске шарды создаются из portfolios.json.
+        """
+        entry = self._shard_manifest_entry
+        if entry is None or entry[0] != self._file_signature(self.shard_manifest_file):
+            entry = self._read_json(self.shard_manifest_file, None)
+            self._shard_manifest_entry = entry
+        if entry[1] is None:
+            return self._bootstrap_shards()
+        return entry[1]
+
+    def _bootstrap_shards(self):
+        with file_lock(self.shard_manifest_file, exclusive=True):
+            signature, manifest = self._read_json(self.shard_manifest_file, None)
+            if manifest is None:
+                portfolios = self._load_cached(self.portfolios_file, [])
+                manifest = self._write_shards(portfolios, self._default_shard_count, 1)
+                self._save_json(manifest, self.shard_manifest_file)
+                signature = self._file_signature(self.shard_manifest_file)
+                logger.info("Created %d portfolio shards from %s", manifest['shards'], self.portfolios_file)
+            self._shard_manifest_entry = (signature, manifest)
+        return manifest
+
+    def _shard_path(self, manifest, user_id):
+        shard = record_key(user_id) % manifest['shards']
+        return os.path.join(self.portfolio_shards_dir, f"shard_g{manifest['generation']}_{shard:03d}.json")
+
+    def _shard_paths(self, manifest):
+        return [os.path.join(self.portfolio_shards_dir, f"shard_g{manifest['generation']}_{shard:03d}.json")
+                for shard in range(manifest['shards'])]
+
+    def _write_shards(self, portfolios, shard_count, generation):
+        """Раскладывает портфели по shard_count файлам поколения generation."""
+        manifest = {"shards": shard_count, "generation": generation}
+        shards = {path: [] for path in self._shard_paths(manifest)}
         for portfolio in portfolios:
-            if portfolio.get('user_id') == user_id:
+            shards[self._shard_path(manifest, portfolio['user_id'])].append(portfolio)
+        os.makedirs(self.portfolio_shards_dir, exist_ok=True)
+        for path, shard in shards.items():
+            self._save_json(shard, path)
+        return manifest
+
+    @contextmanager
+    def _shard_locks(self, keys=None):
+        """
+        Блокирует шарды пользователей keys (все шарды и манифест, если keys=None)
+        в порядке путей, чтобы пакеты с пересекающимися шардами не взаимоблокировались.
+        Если пока ждали блокировку, прошел решардинг, блокировка берется заново.
+        """
+        while True:
+            manifest = self._shard_manifest()
+            if keys is None:
+                paths = [self.shard_manifest_file, *self._shard_paths(manifest)]
+            else:
+                paths = sorted({self._shard_path(manifest, key) for key in keys})
+            with ExitStack() as stack:
+                for path in paths:
+                    stack.enter_context(file_lock(path, exclusive=True))
+                if self._shard_manifest()['generation'] == manifest['generation']:
+                    yield
+                    return
+
+    def _shard_index(self, path):
+        """Возвращает (список шарда из кэша, индекс user_id -> portfolio)."""
+        shard = self._load_cached(path, [])
+        entry = self._shard_indexes.get(path)
+        if entry is None or entry[0] is not shard:
+            entry = (shard, {portfolio.get('user_id'): portfolio for portfolio in shard})
+            self._shard_indexes[path] = entry
+        return entry
+
+    def _load_sharded_portfolios(self):
+        while True:
+            manifest = self._shard_manifest()
+            portfolios = [portfolio for path in self._shard_paths(manifest)
+                          for portfolio in self._load_cached(path, [])]
+            # Решардинг между чтением манифеста и шардов — читаем заново
+            if self._shard_manifest()['generation'] == manifest['generation']:
+                return portfolios
+
+    def _get_sharded_portfolio(self, user_id):
+        while True:
+            manifest = self._shard_manifest()
+            path = self._shard_path(manifest, user_id)
+            found = False
+            if not self._is_warm(path):
+                # Холодный старт: одна запись шарда по индексу
+                found, portfolio = self._lookup_record(path, user_id)
+            if not found:
+                portfolio = self._shard_index(path)[1].get(user_id)
+                portfolio = copy.deepcopy(portfolio) if portfolio is not None else None
+            if self._shard_manifest()['generation'] == manifest['generation']:
                 return portfolio
-        return None
+
+    def _update_sharded_portfolios(self, portfolios):
+        """Перезаписывает только шарды, в которых лежат измененные портфели."""
+        with self._locked_files('portfolios', [portfolio['user_id'] for portfolio in portfolios]):
+            manifest = self._shard_manifest()
+            by_shard = {}
+            for portfolio in portfolios:
+                by_shard.setdefault(self._shard_path(manifest, portfolio['user_id']), []).append(portfolio)
+            for path, shard_portfolios in sorted(by_shard.items()):
+                shard, index = self._shard_index(path)
+                self._merge_portfolios(shard, index, shard_portfolios)
+                self._save_json(shard, path)
+
+    def reshard_portfolios(self, shard_count):
+        """
+        Перераскладывает портфели по shard_count шардам. Новые шарды пишутся
+        файлами следующего поколения, затем атомарно заменяется манифест и
+        удаляются старые файлы; параллельные сделки ждут на блокировках шардов
+        и после решардинга берут блокировку заново по новому манифесту.
+        """
+        if not self._sharded:
+            raise ValueError("Решардинг доступен только при \"portfolio_layout\": \"sharded\".")
+        if not isinstance(shard_count, int) or shard_count < 1:
+            raise ValueError("Число шардов должно быть положительным целым числом.")
+
+        self.flush()
+        with self._locked_files('portfolios'):
+            old_manifest = self._shard_manifest()
+            old_paths = self._shard_paths(old_manifest)
+            portfolios = [portfolio for path in old_paths for portfolio in self._load_cached(path, [])]
+
+            manifest = self._write_shards(portfolios, shard_count, old_manifest['generation'] + 1)
+            self._save_json(manifest, self.shard_manifest_file)
+            self._shard_manifest_entry = None
+
+            for path in old_paths:
+                for file_path in (path, f"{path}.idx", f"{path}.lock"):
+                    try:
+                        os.unlink(file_path)
+                    except FileNotFoundError:
+                        pass
+                self._cache.pop(path, None)
+                self._shard_indexes.pop(path, None)
+            fsync_dir(self.portfolio_shards_dir)
+
+        return {"shards": shard_count, "portfolios": len(portfolios)}
+
+    # --- Журнал портфелей ---
+    def _rebase_portfolio_log(self, portfolios):
+        self._log_base = portfolios
+        self._log_inode = self._portfolio_log.inode()
+        self._log_offset = 0
+        self._log_records = 0
+
+    def _apply_portfolio_log(self, portfolios):
+        """Накатывает на снимок портфелей новые записи журнала."""
+        log = self._portfolio_log
+        if portfolios is not self._log_base or log.inode() != self._log_inode:
+            if portfolios is self._log_base:
+                # Журнал пересоздан компакцией другого процесса: снимок тоже новый
+                self._cache.pop(self.portfolios_file, None)
+                portfolios = self._load_cached(self.portfolios_file, [])
+            self._rebase_portfolio_log(portfolios)
+
+        records, self._log_offset = log.read_from(self._log_offset)
+        if records:
+            index = self._ensure_portfolio_index(portfolios)
+            for record in records:
+                portfolio = index.get(record['user_id'])
+                if portfolio is None:
+                    portfolio = {"user_id": record['user_id'], "wallets": {}}
+                    portfolios.append(portfolio)
+                    index[portfolio['user_id']] = portfolio
+                apply_record(portfolio, record)
+            self._log_records += len(records)
+        return portfolios
+
+    def compact_portfolio_log(self):
+        """
+        Записывает новый снимок portfolios.json (атомарно) и очищает журнал.
+        Сбой между этими шагами безопасен: журнал повторно накатывается на
+        снимок, который уже содержит его записи, с тем же результатом.
+        """
+        if self._portfolio_log is None:
+            return
+        with self._locked_files('portfolios'):
+            portfolios = self._load_portfolios()
+            self._save_json(portfolios, self.portfolios_file)
+            self._portfolio_log.reset()
+            self._rebase_portfolio_log(portfolios)
 
     def get_rates(self):
-        return self.load_or_default(self.rates_file, {"pairs": {}, "last_refresh": None})
+        return self._load_cached(self.rates_file, {"pairs": {}, "last_refresh": None})
 
     def save_rates(self, rates):
         self._save_json(rates, self.rates_file)
 
     # --- Новые методы для Parser Service ---
     def get_exchange_rates_history(self):
-        return self.load_or_default(self.exchange_rates_history_file, {})
+        """
+        Вся история целиком: старый exchange_rates.json плюс сегменты.
+        Загружает все записи в память, для выборок используйте iter_exchange_rates_history.
+        """
+        legacy = self._load_cached(self.exchange_rates_history_file, {})
+        history = dict(legacy.get("history", {}))
+        for record in self._history_store.iter_records():
+            history[record['id']] = record
+        return {**legacy, "history": history}
 
     def save_exchange_rates_history(self, history_data):
         self._save_json(history_data, self.exchange_rates_history_file)
 
+    def append_exchange_rates_history(self, records):
+        """Дописывает новые записи истории в текущий сегмент."""
+        return self._history_store.append(records)
+
+    def iter_exchange_rates_history(self, start=None, end=None, pair=None):
+        """Потоково отдает записи истории за интервал [start, end]."""
+        return self._history_store.iter_records(start, end, pair)
+
     def load_or_default(self, file_path, default_value):
         try:
             with open(file_path, "r", encoding="utf-8") as f:
@@ -103,4 +735,12 @@ class DatabaseManager:
             return default_value
 
 
-database_manager = DatabaseManager()
+def _create_database_manager():
+    """Выбирает реализацию хранилища по настройке storage_backend ('json' или 'sqlite')."""
+    if settings_loader.get('storage_backend', 'json') == 'sqlite':
+        from .sqlite_database import SQLiteDatabaseManager
+        return SQLiteDatabaseManager()
+    return DatabaseManager()
+
+
+database_manager = _create_database_manager()
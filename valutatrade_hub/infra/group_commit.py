@@ -0,0 +1,184 @@
+# valutatrade_hub/infra/group_commit.py
+import copy
+import logging
+import threading
+
+from .locking import hold_locks, release_locks, try_hold_lock
+from .portfolio_log import PortfolioLog, apply_record, make_record
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommit:
+    """
+    Групповая фиксация изменений портфелей.
+
+    Измененные портфели копятся в памяти, а каждое изменение сразу
+    дописывается короткой строкой в журнал намерений. Буфер сбрасывается
+    в хранилище одной записью: по таймеру (interval секунд после первого
+    изменения), при накоплении max_pending портфелей и при выходе.
+
+    Пока в буфере есть несброшенные изменения, процесс держит блокировку
+    файлов портфелей (lock_paths()): другие процессы ждут сброса и затем
+    читают уже сохраненные балансы, поэтому абсолютные значения буфера и
+    журнала не перезаписывают чужие сделки. По той же причине журнал
+    упавшей сессии накатывается под блокировкой хранилища до любой другой
+    записи (см. recover).
+
+    Журнал намерений принадлежит одной сессии: его блокировку процесс
+    держит до завершения, второй процесс работает без буферизации.
+    """
+
+    def __init__(self, intent_path, store, lock_paths, interval=0.2, max_pending=100, sync=True):
+        self.lock = threading.RLock()
+        self._log = PortfolioLog(intent_path)
+        self._store = store  # store(portfolios) — запись пачки портфелей в хранилище
+        self._lock_paths = lock_paths  # lock_paths() — файлы, блокируемые на время буферизации
+        self._interval = interval
+        self._max_pending = max_pending
+        self._sync = sync
+        self._pending = {}  # user_id -> portfolio
+        self._timer = None
+        self._held = None  # пути удерживаемых блокировок хранилища
+        self._depth = 0  # вложенность критических секций (hold/release_if_idle)
+
+    @property
+    def intent_path(self):
+        return self._log.file_path
+
+    def open(self, load_portfolio):
+        """
+        Захватывает журнал намерений и накатывает записи упавшей сессии.
+        Вызывается под блокировкой хранилища. load_portfolio(user_id)
+        возвращает сохраненный портфель. Возвращает False, если журнал
+        занят другим процессом.
+        """
+        if not try_hold_lock(self._log.file_path):
+            return False
+        self.recover(load_portfolio)
+        return True
+
+    def recover(self, load_portfolio):
+        """
+        Накатывает журнал намерений упавшей сессии на хранилище и очищает его.
+        Вызывается под блокировкой хранилища, пока журнал не удерживает живой
+        процесс: хранилище не менялось с момента падения, и абсолютные
+        балансы журнала остаются верными.
+        """
+        with self.lock:
+            records, _ = self._log.read_from(0)
+            if not records:
+                return 0
+            recovered = {}
+            for record in records:
+                user_id = record['user_id']
+                portfolio = recovered.get(user_id)
+                if portfolio is None:
+                    portfolio = load_portfolio(user_id) or {"user_id": user_id, "wallets": {}}
+                    recovered[user_id] = portfolio
+                apply_record(portfolio, record)
+            self._store(list(recovered.values()))
+            self._log.reset()
+            logger.info("Recovered %d pending portfolio changes from %s", len(records), self._log.file_path)
+            return len(records)
+
+    def hold(self):
+        """
+        Начало критической секции: берет блокировку файлов портфелей, если
+        процесс ее еще не держит. Вызывается под self.lock.
+        """
+        if self._held is None:
+            while True:
+                paths = self._lock_paths()
+                hold_locks(paths)
+                # Набор файлов мог измениться, пока ждали (например, решардинг)
+                if self._lock_paths() == paths:
+                    break
+                release_locks(paths)
+            self._held = paths
+        self._depth += 1
+
+    def release_if_idle(self):
+        """Конец критической секции: блокировка снимается, если буфер пуст."""
+        self._depth -= 1
+        self._release_if_idle()
+
+    def _release_if_idle(self):
+        if self._depth == 0 and not self._pending and self._held is not None:
+            release_locks(self._held)
+            self._held = None
+
+    def get(self, user_id):
+        """Копия еще не сброшенного портфеля или None."""
+        with self.lock:
+            portfolio = self._pending.get(user_id)
+            return copy.deepcopy(portfolio) if portfolio is not None else None
+
+    def overlay(self, portfolios):
+        """Список портфелей с подставленными несброшенными версиями."""
+        with self.lock:
+            if not self._pending:
+                return portfolios
+            pending = dict(self._pending)
+        result = [pending.pop(portfolio.get('user_id'), portfolio) for portfolio in portfolios]
+        result.extend(pending.values())
+        return result
+
+    def stage(self, portfolios, load_portfolio):
+        """
+        Записывает изменения в журнал намерений и кладет портфели в буфер.
+        Вызывается внутри критической секции (hold), под блокировкой хранилища.
+        """
+        with self.lock:
+            records = []
+            for portfolio in portfolios:
+                user_id = portfolio['user_id']
+                current = self._pending.get(user_id)
+                if current is None:
+                    current = load_portfolio(user_id)
+                record = make_record(current, portfolio)
+                if record is not None:
+                    records.append(record)
+                    self._pending[user_id] = copy.deepcopy(portfolio)
+            if not records:
+                return
+            self._log.append_many(records, sync=self._sync)
+
+            if len(self._pending) >= self._max_pending:
+                self.flush()
+            elif self._timer is None:
+                self._start_timer()
+
+    def _start_timer(self):
+        self._timer = threading.Timer(self._interval, self._timed_flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            # Буфер, журнал намерений и блокировка остаются, сброс повторится по таймеру
+            logger.exception("Group commit flush failed")
+            with self.lock:
+                if self._timer is None and self._pending:
+                    self._start_timer()
+
+    def flush(self):
+        """
+        Сбрасывает буфер в хранилище одной записью, очищает журнал намерений
+        и отпускает блокировку хранилища (если не идет критическая секция).
+        """
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return 0
+            count = len(self._pending)
+            self._store(list(self._pending.values()))
+            self._log.reset()
+            self._pending.clear()
+            self._release_if_idle()
+            logger.debug("Group commit: flushed %d portfolios", count)
+            return count
@@ -0,0 +1,152 @@
+# valutatrade_hub/infra/history_store.py
+import json
+import logging
+import os
+from datetime import datetime
+
+from .locking import file_lock
+from .portfolio_log import fsync_dir
+
+logger = logging.getLogger(__name__)
+
+
+def _to_iso(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Unsupported timestamp type: {type(value).__name__}")
+
+
+class SegmentedHistoryStore:
+    """
+    История курсов в виде append-only сегментов JSON Lines.
+
+    Сегменты лежат в каталоге history/ и переключаются при смене дня
+    или при превышении max_segment_bytes. manifest.json хранит для каждого
+    сегмента диапазон timestamp и размер, чтобы чтение по диапазону
+    открывало только нужные файлы.
+    """
+
+    def __init__(self, dir_path, max_segment_bytes=8 * 1024 * 1024):
+        self.dir_path = dir_path
+        self.manifest_file = os.path.join(dir_path, "manifest.json")
+        self.max_segment_bytes = max_segment_bytes
+
+    # --- Манифест ---
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"segments": []}
+
+    def _save_manifest(self, manifest):
+        tmp_path = f"{self.manifest_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_file)
+        fsync_dir(self.dir_path)
+
+    def _segment_for(self, manifest, day, incoming_bytes):
+        """Возвращает сегмент для записи, при необходимости открывая новый."""
+        segments = manifest['segments']
+        if segments:
+            last = segments[-1]
+            if last['day'] == day and last['bytes'] + incoming_bytes <= self.max_segment_bytes:
+                return last
+            seq = last['seq'] + 1 if last['day'] == day else 0
+        else:
+            seq = 0
+        segment = {"name": f"{day}-{seq:03d}.jsonl", "day": day, "seq": seq,
+                   "start": None, "end": None, "records": 0, "bytes": 0}
+        segments.append(segment)
+        return segment
+
+    # --- Запись ---
+    def append(self, records):
+        """
+        Дописывает записи истории (dict с полем timestamp) в текущий сегмент.
+        Стоимость пропорциональна числу новых записей, а не размеру истории.
+        """
+        if not records:
+            return 0
+        os.makedirs(self.dir_path, exist_ok=True)
+        with file_lock(self.manifest_file, exclusive=True):
+            self._append_locked(records)
+        return len(records)
+
+    def _append_locked(self, records):
+        manifest = self.load_manifest()
+
+        # Записи одной выборки группируем по дню, чтобы не смешивать сутки в сегменте
+        by_day = {}
+        for record in records:
+            by_day.setdefault(record['timestamp'][:10], []).append(record)
+
+        for day, day_records in sorted(by_day.items()):
+            payload = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in day_records)
+            data = payload.encode("utf-8")
+            segment = self._segment_for(manifest, day, len(data))
+
+            with open(os.path.join(self.dir_path, segment['name']), "a+b") as f:
+                # Если прошлый процесс упал посреди записи, отделяем оборванный хвост
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        data = b"\n" + data
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            timestamps = [record['timestamp'] for record in day_records]
+            segment['start'] = min([segment['start'] or timestamps[0], *timestamps])
+            segment['end'] = max([segment['end'] or timestamps[0], *timestamps])
+            segment['records'] += len(day_records)
+            segment['bytes'] += len(data)
+
+        self._save_manifest(manifest)
+
+    # --- Чтение ---
+    def iter_records(self, start=None, end=None, pair=None):
+        """
+        Потоково отдает записи с start <= timestamp <= end (ISO-строки или datetime).
+        Сегменты вне диапазона не открываются. pair вида 'BTC_USD' фильтрует пару.
+        """
+        start, end = _to_iso(start), _to_iso(end)
+        for segment in self.load_manifest()['segments']:
+            if start is not None and segment['end'] is not None and segment['end'] < start:
+                continue
+            if end is not None and segment['start'] is not None and segment['start'] > end:
+                continue
+            for record in self._read_segment(segment['name']):
+                timestamp = record['timestamp']
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    continue
+                if pair is not None and f"{record['from_currency']}_{record['to_currency']}" != pair:
+                    continue
+                yield record
+
+    def _read_segment(self, name):
+        """
+        Записи одного сегмента. Строки, испорченные упавшей записью, пропускаются
+        с предупреждением; незавершенная последняя строка не читается.
+        """
+        try:
+            f = open(os.path.join(self.dir_path, name), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # запись еще дописывается
+                try:
+                    record = json.loads(line)
+                except ValueError:  # JSONDecodeError или оборванный UTF-8
+                    logger.warning("Skipping corrupted rate history record in %s", name)
+                    continue
+                yield record
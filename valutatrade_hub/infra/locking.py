@@ -0,0 +1,150 @@
+# valutatrade_hub/infra/locking.py
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессные блокировки недоступны, работаем без них
+    fcntl = None
+
+# Блокировки, уже взятые текущим потоком: путь -> [fd, exclusive, глубина].
+# flock привязан к открытому файлу, поэтому повторный захват тем же потоком
+# через новый дескриптор заблокировал бы сам себя — учитываем вложенность.
+_held = threading.local()
+
+# Блокировки, которые процесс держит дольше одной операции (hold_locks):
+# путь .lock -> fd. Их можно снять из любого потока; пока они взяты,
+# file_lock на тех же путях в этом процессе не блокируется.
+_process_locks = {}
+
+
+def _held_locks():
+    if not hasattr(_held, "locks"):
+        _held.locks = {}
+    return _held.locks
+
+
+@contextmanager
+def file_lock(path, exclusive=False):
+    """
+    Межпроцессная блокировка через fcntl.flock на файле <path>.lock.
+    Разделяемую (shared) блокировку могут держать много читателей сразу,
+    исключающую (exclusive) — только один писатель. Повторный захват в том
+    же потоке не блокируется; shared внутри exclusive не ослабляет блокировку.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    lock_path = f"{path}.lock"
+    if lock_path in _process_locks:
+        # Исключительная блокировка уже у процесса; потоки внутри него упорядочивает владелец
+        yield
+        return
+    locks = _held_locks()
+    held = locks.get(lock_path)
+
+    if held is not None:
+        upgraded = exclusive and not held[1]
+        if upgraded:
+            fcntl.flock(held[0], fcntl.LOCK_EX)
+            held[1] = True
+        held[2] += 1
+        try:
+            yield
+        finally:
+            held[2] -= 1
+            if upgraded:
+                fcntl.flock(held[0], fcntl.LOCK_SH)
+                held[1] = False
+        return
+
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        locks[lock_path] = [fd, exclusive, 1]
+        try:
+            yield
+        finally:
+            del locks[lock_path]
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def try_hold_lock(path):
+    """
+    Пытается без ожидания взять исключительную блокировку <path>.lock на все
+    время жизни процесса (ее снимет ОС при выходе). Возвращает False, если
+    блокировку держит другой процесс.
+    """
+    if fcntl is None:
+        return True
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    return True
+
+
+def hold_locks(paths):
+    """
+    Берет исключительные блокировки paths (в переданном порядке) для всего
+    процесса, до release_locks. В отличие от file_lock, не привязана к потоку.
+    """
+    if fcntl is None:
+        return
+    acquired = []
+    try:
+        for path in paths:
+            lock_path = f"{path}.lock"
+            os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+            _process_locks[lock_path] = fd
+            acquired.append(path)
+    except BaseException:
+        release_locks(acquired)
+        raise
+
+
+def release_locks(paths):
+    """Снимает блокировки, взятые hold_locks."""
+    for path in reversed(paths):
+        fd = _process_locks.pop(f"{path}.lock", None)
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+@contextmanager
+def try_file_lock(path):
+    """Исключительная блокировка без ожидания: отдает True, если удалось ее взять."""
+    if fcntl is None:
+        yield True
+        return
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
@@ -0,0 +1,153 @@
+# valutatrade_hub/infra/portfolio_log.py
+import json
+import logging
+import os
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError
+
+
+def make_record(current, portfolio):
+    """
+    Формирует запись журнала: только изменившиеся кошельки и поля портфеля.
+    Балансы пишутся абсолютными значениями, поэтому повторное применение
+    журнала по порядку всегда дает тот же результат. Возвращает None, если
+    изменений нет.
+    """
+    current = current or {}
+    old_wallets = current.get('wallets', {})
+    new_wallets = portfolio.get('wallets', {})
+
+    record = {"user_id": portfolio['user_id']}
+    changed = {code: wallet for code, wallet in new_wallets.items() if old_wallets.get(code) != wallet}
+    removed = [code for code in old_wallets if code not in new_wallets]
+    if changed or not current:
+        record['wallets'] = changed
+    if removed:
+        record['removed'] = removed
+    for key, value in portfolio.items():
+        if key not in ('user_id', 'wallets') and current.get(key) != value:
+            record[key] = value
+
+    return record if len(record) > 1 else None
+
+
+def apply_record(portfolio, record):
+    """Применяет запись журнала к портфелю (на месте)."""
+    for key, value in record.items():
+        if key == 'wallets':
+            portfolio.setdefault('wallets', {}).update(value)
+        elif key == 'removed':
+            for code in value:
+                portfolio.get('wallets', {}).pop(code, None)
+        elif key != 'user_id':
+            portfolio[key] = value
+
+
+class PortfolioLog:
+    """
+    Append-only журнал изменений портфелей в формате JSON Lines.
+    Каждая сделка дописывает одну короткую строку (с fsync), вместо
+    перезаписи всего portfolios.json.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def inode(self):
+        """Inode файла журнала (меняется при компакции) или None, если файла нет."""
+        try:
+            return os.stat(self.file_path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records, sync=True):
+        """
+        Дописывает пачку записей одной операцией записи и одним fsync.
+        При sync=False запись переживает падение процесса, но не сбой питания.
+        """
+        payload = "".join(json.dumps(record, default=_default, separators=(",", ":")) + "\n" for record in records)
+        with open(self.file_path, "a+b") as f:
+            # Если прошлый процесс упал посреди записи, отделяем оборванный хвост
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    payload = "\n" + payload
+            f.write(payload.encode("utf-8"))
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def read_from(self, offset):
+        """
+        Читает записи, начиная с байтового смещения offset.
+        Возвращает (записи, новое смещение); незавершенная последняя строка
+        не читается, пока не будет дописана.
+        """
+        try:
+            with open(self.file_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning("Skipping corrupted portfolio log record in %s", self.file_path)
+        return records, offset + end
+
+    def records_for(self, user_id):
+        """Записи журнала одного пользователя (по порядку)."""
+        # make_record всегда пишет user_id первым полем — отсеиваем строки без разбора JSON
+        prefix = f'{{"user_id":{json.dumps(user_id)},'.encode("utf-8")
+        records = []
+        try:
+            with open(self.file_path, "rb") as f:
+                for line in f:
+                    if not (line.startswith(prefix) and line.endswith(b"\n")):
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        logger.warning("Skipping corrupted portfolio log record in %s", self.file_path)
+        except FileNotFoundError:
+            pass
+        return records
+
+    def reset(self):
+        """Атомарно заменяет журнал пустым файлом (после записи нового снимка)."""
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+        fsync_dir(os.path.dirname(self.file_path))
+
+
+def fsync_dir(dir_path):
+    """fsync каталога, чтобы переименование файла пережило сбой питания."""
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
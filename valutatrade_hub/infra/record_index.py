@@ -0,0 +1,109 @@
+# valutatrade_hub/infra/record_index.py
+import hashlib
+import json
+import os
+import struct
+
+# Заголовок: magic, размер/mtime_ns/inode файла данных, число записей
+_MAGIC = b"VTHIDX01"
+_HEADER = struct.Struct("<8sqqqq")
+# Запись: ключ, смещение и длина элемента в файле данных
+_ENTRY = struct.Struct("<qqq")
+
+
+def record_key(value) -> int:
+    """int64-ключ индекса: целые ключи как есть, строки — 64-битный хеш."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def dump_list(items, key_field, default=None):
+    """
+    Сериализует список в JSON (каждый элемент с отступом 4) и возвращает
+    (байты, записи индекса [(ключ, смещение, длина), ...]).
+    """
+    parts = [b"[\n"]
+    entries = []
+    offset = 2
+    for i, item in enumerate(items):
+        if i:
+            parts.append(b",\n")
+            offset += 2
+        chunk = json.dumps(item, indent=4, default=default).encode("utf-8")
+        entries.append((record_key(item.get(key_field)), offset, len(chunk)))
+        parts.append(chunk)
+        offset += len(chunk)
+    parts.append(b"\n]\n")
+    return b"".join(parts), entries
+
+
+def write_index(index_path, data_path, entries):
+    """Пишет отсортированный по ключу индекс, привязанный к текущей версии data_path."""
+    stat = os.stat(data_path)
+    entries = sorted(entries)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, stat.st_size, stat.st_mtime_ns, stat.st_ino, len(entries)))
+        for entry in entries:
+            f.write(_ENTRY.pack(*entry))
+    os.replace(tmp_path, index_path)
+
+
+def _entry_at(index_file, position):
+    index_file.seek(_HEADER.size + position * _ENTRY.size)
+    return _ENTRY.unpack(index_file.read(_ENTRY.size))
+
+
+def _lower_bound(index_file, count, key):
+    """Позиция первой записи индекса с ключом >= key (бинарный поиск)."""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _entry_at(index_file, mid)[0] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def lookup(index_path, data_path, key_field, value):
+    """
+    Ищет элемент с item[key_field] == value через индекс: бинарный поиск
+    по записям фиксированной длины и чтение одного фрагмента файла данных.
+    Возвращает (True, элемент или None) или (False, None), если индекса нет
+    или он не соответствует текущей версии файла данных. Отсутствующий файл
+    данных означает пустой список.
+    """
+    try:
+        stat = os.stat(data_path)
+    except FileNotFoundError:
+        return True, None  # файла данных нет — искать нечего
+    try:
+        index_file = open(index_path, "rb")
+    except FileNotFoundError:
+        return False, None
+
+    with index_file:
+        header = index_file.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            return False, None
+        magic, size, mtime_ns, inode, count = _HEADER.unpack(header)
+        if magic != _MAGIC or (stat.st_size, stat.st_mtime_ns, stat.st_ino) != (size, mtime_ns, inode):
+            return False, None
+
+        key = record_key(value)
+        with open(data_path, "rb") as data_file:
+            # Строковые ключи хешируются: проверяем все записи с совпавшим хешем
+            position = _lower_bound(index_file, count, key)
+            while position < count:
+                entry_key, offset, length = _entry_at(index_file, position)
+                if entry_key != key:
+                    break
+                data_file.seek(offset)
+                item = json.loads(data_file.read(length))
+                if item.get(key_field) == value:
+                    return True, item
+                position += 1
+    return True, None
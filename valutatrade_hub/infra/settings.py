@@ -26,6 +26,26 @@ class SettingsLoader:
             'rates_ttl_seconds': 300,  # <--- TTL в секундах
             'default_base_currency': 'USD',
             'log_level': 'INFO',
+            # Хранилище: 'json' (файлы data/*.json) или 'sqlite'
+            'storage_backend': 'json',
+            'sqlite_path': None,  # по умолчанию data/valutatrade.db
+            # Размер сегмента истории курсов (data/history/*.jsonl)
+            'history_segment_max_bytes': 8 * 1024 * 1024,
+            # Журнал изменений портфелей вместо полной перезаписи portfolios.json
+            'portfolio_log_enabled': False,
+            'portfolio_log_compact_threshold': 1000,  # записей журнала до компакции
+            # Раскладка портфелей: 'single' (portfolios.json) или 'sharded' (data/portfolios/)
+            'portfolio_layout': 'single',
+            'portfolio_shards': 16,  # число шардов при первом создании (далее — reshard-portfolios)
+            # Групповая фиксация сделок: буфер + журнал намерений, сброс пачкой
+            'group_commit_enabled': False,
+            'group_commit_interval_ms': 200,  # сброс не позже чем через столько мс
+            'group_commit_max_pending': 100,  # или при стольких измененных портфелях
+            'group_commit_fsync': True,  # fsync каждой записи журнала намерений
+            # Справочник валют (JSON-список); None — встроенный core/currencies.json
+            'currencies_file': None,
+            # LRU-кэш оценок show_portfolio (записей; 0 — отключить)
+            'valuation_cache_size': 1024,
             # Add more settings here
         }
         self._load_from_file()
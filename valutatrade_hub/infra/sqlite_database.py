@@ -0,0 +1,393 @@
+# valutatrade_hub/infra/sqlite_database.py
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from decimal import Decimal
+from pathlib import Path
+
+from .locking import file_lock
+from .portfolio_log import make_record
+from .settings import settings_loader
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL,
+    salt TEXT NOT NULL,
+    registration_date TEXT
+);
+CREATE TABLE IF NOT EXISTS portfolios (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS wallets (
+    user_id INTEGER NOT NULL,
+    currency_code TEXT NOT NULL,
+    balance TEXT NOT NULL,
+    units INTEGER,
+    scale INTEGER,
+    PRIMARY KEY (user_id, currency_code)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rates (
+    pair TEXT PRIMARY KEY,
+    rate TEXT NOT NULL,
+    updated_at TEXT,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS rate_history (
+    id TEXT PRIMARY KEY,
+    from_currency TEXT NOT NULL,
+    to_currency TEXT NOT NULL,
+    rate TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    source TEXT,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_rate_history_pair_ts ON rate_history (from_currency, to_currency, timestamp);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _wallet_row(wallet):
+    """
+    (balance, units, scale) для строки wallets. balance хранит десятичную
+    запись для чтения человеком; кошельки старого формата пишутся без units.
+    """
+    if 'units' in wallet:
+        return str(Decimal(wallet['units']).scaleb(-wallet['scale'])), wallet['units'], wallet['scale']
+    return str(wallet['balance']), None, None
+
+
+def _wallet_from_row(row):
+    if row['units'] is None:
+        return {"balance": row['balance']}
+    return {"units": row['units'], "scale": row['scale']}
+
+
+class SQLiteDatabaseManager:
+    """
+    Singleton-хранилище на SQLite с тем же интерфейсом, что и DatabaseManager.
+    Сделки обновляют только строки кошельков одного пользователя.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        """Открывает соединение и создает схему при первом запуске."""
+        self.db_file = settings_loader.get('sqlite_path') or os.path.join(BASE_DIR, "data", "valutatrade.db")
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # Служебные данные лежат в таблице meta; путь нужен для совместимости
+        # с DatabaseManager (load_or_default(meta_file, ...))
+        self.meta_file = f"{self.db_file}#meta"
+        # Кэш get_rates: (ревизия курсов, данные). Пока курсы не менялись, возвращается
+        # тот же объект, и кэши, привязанные к нему (rate_snapshot_for), остаются актуальными
+        self._rates_entry = None
+        self._cache_hits = 0
+        self._cache_misses = 0
+        # Базы, созданные до появления версии портфеля
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(portfolios)")}
+        if 'version' not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE portfolios ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        # ...и до появления балансов в минимальных единицах (старые строки читаются из balance)
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(wallets)")}
+        if 'units' not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE wallets ADD COLUMN units INTEGER")
+                self._conn.execute("ALTER TABLE wallets ADD COLUMN scale INTEGER")
+
+    @contextmanager
+    def locked(self, name, keys=None):
+        """
+        Исключительная блокировка для read-modify-write сценария name
+        (проверка баланса и запись сделки выполняются атомарно между процессами).
+        keys принимается для совместимости с JSON-хранилищем и не сужает блокировку.
+        """
+        with file_lock(f"{self.db_file}.{name}", exclusive=True):
+            yield
+
+    def flush(self):
+        """Каждая сделка фиксируется транзакцией сразу, буфера нет."""
+        return 0
+
+    # --- Пользователи ---
+    def get_all_users(self):
+        rows = self._conn.execute("SELECT * FROM users ORDER BY user_id")
+        return [dict(row) for row in rows]
+
+    def save_users(self, users):
+        with self._conn:
+            self._conn.execute("DELETE FROM users")
+            self._conn.executemany(
+                "INSERT INTO users (user_id, username, hashed_password, salt, registration_date) "
+                "VALUES (:user_id, :username, :hashed_password, :salt, :registration_date)",
+                users,
+            )
+
+    def get_user_by_username(self, username):
+        row = self._conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return dict(row) if row else None
+
+    def add_user(self, user):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO users (user_id, username, hashed_password, salt, registration_date) "
+                "VALUES (:user_id, :username, :hashed_password, :salt, :registration_date)",
+                user,
+            )
+
+    def allocate_user_id(self):
+        """Выдает следующий user_id по счетчику в таблице meta (в одной транзакции)."""
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'next_user_id'").fetchone()
+            if row is not None:
+                next_id = int(row['value'])
+            else:
+                next_id = self._conn.execute("SELECT COALESCE(MAX(user_id), 0) + 1 FROM users").fetchone()[0]
+            self._set_meta('next_user_id', next_id + 1)
+        return next_id
+
+    # --- Портфели ---
+    def get_all_portfolios(self):
+        portfolios = {row['user_id']: {"user_id": row['user_id'], "wallets": {}, "version": row['version']}
+                      for row in self._conn.execute("SELECT user_id, version FROM portfolios ORDER BY user_id")}
+        for row in self._conn.execute("SELECT user_id, currency_code, balance, units, scale FROM wallets"):
+            portfolio = portfolios.setdefault(row['user_id'], {"user_id": row['user_id'], "wallets": {}})
+            portfolio['wallets'][row['currency_code']] = _wallet_from_row(row)
+        return list(portfolios.values())
+
+    def save_portfolios(self, portfolios):
+        with self._conn:
+            self._conn.execute("DELETE FROM wallets")
+            self._conn.execute("DELETE FROM portfolios")
+            for portfolio in portfolios:
+                self._insert_portfolio(portfolio)
+
+    def get_portfolio_by_user_id(self, user_id):
+        row = self._conn.execute("SELECT version FROM portfolios WHERE user_id = ?", (user_id,)).fetchone()
+        if not row:
+            return None
+        version = row['version']
+        rows = self._conn.execute("SELECT currency_code, balance, units, scale FROM wallets WHERE user_id = ?",
+                                  (user_id,))
+        return {"user_id": user_id, "wallets": {row['currency_code']: _wallet_from_row(row) for row in rows},
+                "version": version}
+
+    def add_portfolio(self, portfolio):
+        with self._conn:
+            self._insert_portfolio(portfolio)
+
+    def update_portfolio(self, portfolio):
+        """Обновляет только изменившиеся кошельки пользователя в одной транзакции."""
+        self.update_portfolios([portfolio])
+
+    def update_portfolios(self, portfolios):
+        """Сохраняет изменения нескольких портфелей в одной транзакции."""
+        with self._conn:
+            for portfolio in portfolios:
+                current = self.get_portfolio_by_user_id(portfolio['user_id'])
+                if current is None:
+                    self._insert_portfolio(portfolio)
+                    continue
+                record = make_record(current, portfolio)
+                if record is None:
+                    continue
+                for code, wallet in record.get('wallets', {}).items():
+                    self._conn.execute(
+                        "INSERT INTO wallets (user_id, currency_code, balance, units, scale) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (user_id, currency_code) DO UPDATE SET balance = excluded.balance, "
+                        "units = excluded.units, scale = excluded.scale",
+                        (portfolio['user_id'], code, *_wallet_row(wallet)),
+                    )
+                for code in record.get('removed', []):
+                    self._conn.execute("DELETE FROM wallets WHERE user_id = ? AND currency_code = ?",
+                                       (portfolio['user_id'], code))
+                if 'version' in record:
+                    self._conn.execute("UPDATE portfolios SET version = ? WHERE user_id = ?",
+                                       (record['version'], portfolio['user_id']))
+
+    def _insert_portfolio(self, portfolio):
+        self._conn.execute("INSERT INTO portfolios (user_id, version) VALUES (?, ?)",
+                           (portfolio['user_id'], portfolio.get('version', 0)))
+        self._conn.executemany(
+            "INSERT INTO wallets (user_id, currency_code, balance, units, scale) VALUES (?, ?, ?, ?, ?)",
+            [(portfolio['user_id'], code, *_wallet_row(wallet))
+             for code, wallet in portfolio.get('wallets', {}).items()],
+        )
+
+    # --- Курсы ---
+    def get_rates(self):
+        """
+        Курсы в формате rates.json. Объект общий для всех читателей, пока
+        курсы не изменятся: изменять его можно только с последующим save_rates.
+        """
+        revision = self._get_meta('rates_revision')
+        entry = self._rates_entry
+        if entry is not None and entry[0] == revision:
+            self._cache_hits += 1
+            return entry[1]
+        self._cache_misses += 1
+        rates = self._read_rates()
+        self._rates_entry = (revision, rates)
+        return rates
+
+    def _read_rates(self):
+        pairs = {row['pair']: {"rate": row['rate'], "updated_at": row['updated_at'], "source": row['source']}
+                 for row in self._conn.execute("SELECT * FROM rates")}
+        rates = {"pairs": pairs, "last_refresh": self._get_meta('rates_last_refresh')}
+        version = self._get_meta('rates_version')
+        if version is not None:
+            rates['version'] = int(version)
+        source = self._get_meta('rates_source')
+        if source is not None:
+            rates['source'] = source
+        return rates
+
+    def save_rates(self, rates):
+        with self._conn:
+            self._conn.execute("DELETE FROM rates")
+            self._conn.executemany(
+                "INSERT INTO rates (pair, rate, updated_at, source) VALUES (?, ?, ?, ?)",
+                [(pair, str(info['rate']), info.get('updated_at'), info.get('source'))
+                 for pair, info in rates.get('pairs', {}).items()],
+            )
+            self._set_meta('rates_last_refresh', rates.get('last_refresh'))
+            if 'version' in rates:
+                self._set_meta('rates_version', rates['version'])
+            if 'source' in rates:
+                self._set_meta('rates_source', rates['source'])
+            # Ревизия меняется при каждой записи курсов (в том числе другим процессом)
+            revision = self._get_meta('rates_revision')
+            self._set_meta('rates_revision', int(revision or 0) + 1)
+        self._rates_entry = None
+
+    # --- История курсов (Parser Service) ---
+    def get_exchange_rates_history(self):
+        history = {}
+        for row in self._conn.execute("SELECT * FROM rate_history ORDER BY timestamp"):
+            record = dict(row)
+            record['meta'] = json.loads(record['meta']) if record['meta'] else {}
+            history[record['id']] = record
+        return {"history": history}
+
+    def save_exchange_rates_history(self, history_data):
+        """Дописывает новые записи истории; существующие записи не переписываются."""
+        self.append_exchange_rates_history(list(history_data.get('history', {}).values()))
+
+    def append_exchange_rates_history(self, records):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO rate_history (id, from_currency, to_currency, rate, timestamp, source, meta) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(record['id'], record['from_currency'], record['to_currency'], str(record['rate']),
+                  record['timestamp'], record.get('source'), json.dumps(record.get('meta', {})))
+                 for record in records],
+            )
+        return len(records)
+
+    def iter_exchange_rates_history(self, start=None, end=None, pair=None):
+        """Потоково отдает записи истории за интервал [start, end] по индексу (пара, timestamp)."""
+        query = "SELECT * FROM rate_history WHERE 1 = 1"
+        params = []
+        if pair is not None:
+            from_currency, to_currency = pair.split('_')
+            query += " AND from_currency = ? AND to_currency = ?"
+            params += [from_currency, to_currency]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(start if isinstance(start, str) else start.isoformat())
+        if end is not None:
+            query += " AND timestamp <= ?"
+            params.append(end if isinstance(end, str) else end.isoformat())
+        for row in self._conn.execute(query + " ORDER BY timestamp", params):
+            record = dict(row)
+            record['meta'] = json.loads(record['meta']) if record['meta'] else {}
+            yield record
+
+    # --- Кэш и обслуживание ---
+    def cache_stats(self):
+        """Счетчики попаданий и промахов кэша курсов."""
+        return {"hits": self._cache_hits, "misses": self._cache_misses,
+                "documents": int(self._rates_entry is not None)}
+
+    def invalidate_cache(self):
+        """Сбрасывает кэш курсов (следующее чтение пойдет в базу)."""
+        self._rates_entry = None
+
+    def compact_portfolio_log(self):
+        """Аналог компакции журнала портфелей: переносит WAL в файл базы и усекает его."""
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def load_or_default(self, file_path, default_value):
+        """Служебные данные (meta_file) из таблицы meta или JSON-файл, как в DatabaseManager."""
+        if file_path == self.meta_file:
+            meta = {}
+            for row in self._conn.execute("SELECT key, value FROM meta"):
+                try:
+                    meta[row['key']] = json.loads(row['value'])
+                except (TypeError, json.JSONDecodeError):
+                    meta[row['key']] = row['value']
+            return meta or default_value
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            return json.loads(content) if content else default_value
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default_value
+
+    # --- Служебное ---
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, None if value is None else str(value)),
+        )
+
+
+def migrate_from_json(source, target):
+    """
+    Переносит users/portfolios/rates/history из JSON-хранилища source
+    в SQLite-хранилище target. Существующие данные target заменяются.
+    Возвращает количество перенесенных записей по типам.
+    """
+    users = source.get_all_users()
+    portfolios = source.get_all_portfolios()
+    rates = source.get_rates()
+    history = source.get_exchange_rates_history()
+
+    target.save_users(users)
+    target.save_portfolios(portfolios)
+    target.save_rates(rates)
+    target.save_exchange_rates_history(history)
+
+    meta = source.load_or_default(source.meta_file, {})
+    next_id = meta.get('next_user_id', max((user['user_id'] for user in users), default=0) + 1)
+    with target._conn:
+        target._set_meta('next_user_id', next_id)
+
+    return {
+        "users": len(users),
+        "portfolios": len(portfolios),
+        "rates": len(rates.get('pairs', {})),
+        "history": len(history.get('history', {})),
+    }
@@ -0,0 +1,215 @@
+# valutatrade_hub/infra/timeseries.py
+import mmap
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_EVEN, Decimal
+from pathlib import Path
+
+from .locking import file_lock
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен: без него возвращаются memoryview
+    np = None
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Курс хранится как целое число единиц 1e-8 (как сатоши)
+RATE_SCALE = 10 ** 8
+_ITEM_SIZE = 8  # int64
+
+
+def to_epoch_us(value) -> int:
+    """ISO-строка (UTC без зоны), datetime или число микросекунд -> микросекунды epoch."""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp()) * 1_000_000 + value.microsecond
+
+
+def from_epoch_us(value: int) -> str:
+    """Микросекунды epoch -> ISO-строка UTC без зоны (формат timestamp в истории)."""
+    return datetime.fromtimestamp(value / 1_000_000, tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def to_fixed(rate) -> int:
+    """Decimal/str курс -> целое число единиц RATE_SCALE."""
+    return int((Decimal(str(rate)) * RATE_SCALE).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def from_fixed(value: int) -> Decimal:
+    return Decimal(int(value)) / RATE_SCALE
+
+
+class ColumnarRateHistory:
+    """
+    Колоночное хранилище истории курсов: на каждую пару два файла
+    int64 (<PAIR>.ts — микросекунды epoch, <PAIR>.rate — курс * RATE_SCALE).
+    Файлы читаются через mmap, выборка по времени — бинарный поиск без копирования.
+    """
+
+    def __init__(self, dir_path=None):
+        self.dir_path = dir_path or os.path.join(BASE_DIR, "data", "timeseries")
+        self._maps = {}  # pair -> ((размер, inode колонок), timestamps, rates)
+
+    def _paths(self, pair):
+        return (os.path.join(self.dir_path, f"{pair}.ts"),
+                os.path.join(self.dir_path, f"{pair}.rate"))
+
+    def pairs(self):
+        """Список пар, для которых есть история."""
+        try:
+            names = os.listdir(self.dir_path)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-3] for name in names if name.endswith(".ts"))
+
+    # --- Запись ---
+    def append(self, pair, timestamp, rate):
+        self.append_many({pair: rate}, timestamp)
+
+    def append_many(self, rates_map, timestamp):
+        """
+        Дописывает по одной точке для каждой пары. Точки старше последней
+        сохраненной пропускаются, чтобы колонки оставались отсортированными.
+        """
+        os.makedirs(self.dir_path, exist_ok=True)
+        ts_us = to_epoch_us(timestamp)
+        for pair, rate in rates_map.items():
+            ts_path, rate_path = self._paths(pair)
+            with file_lock(ts_path, exclusive=True):
+                count = self._repair(ts_path, rate_path)
+                if count and self._last_timestamp(ts_path, count) > ts_us:
+                    continue
+                with open(ts_path, "ab") as f:
+                    array('q', [ts_us]).tofile(f)
+                with open(rate_path, "ab") as f:
+                    array('q', [to_fixed(rate)]).tofile(f)
+
+    def rebuild(self, records):
+        """
+        Пересобирает колонки пар из записей истории (dict с from_currency,
+        to_currency, rate, timestamp) — например, из exchange_rates.json и
+        сегментов, записанных до появления колоночного хранилища.
+        Возвращает {пара: число точек}.
+        """
+        points = {}
+        for record in records:
+            pair = f"{record['from_currency']}_{record['to_currency']}"
+            points.setdefault(pair, {})[to_epoch_us(record['timestamp'])] = record['rate']
+
+        os.makedirs(self.dir_path, exist_ok=True)
+        counts = {}
+        for pair, by_time in points.items():
+            ts_path, rate_path = self._paths(pair)
+            timestamps = sorted(by_time)
+            with file_lock(ts_path, exclusive=True):
+                for path, column in ((ts_path, array('q', timestamps)),
+                                     (rate_path, array('q', (to_fixed(by_time[ts]) for ts in timestamps)))):
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        column.tofile(f)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+            self._maps.pop(pair, None)
+            counts[pair] = len(timestamps)
+        return counts
+
+    @staticmethod
+    def _repair(ts_path, rate_path):
+        """Выравнивает длины колонок после прерванной записи; возвращает число точек."""
+        sizes = []
+        for path in (ts_path, rate_path):
+            try:
+                sizes.append(os.path.getsize(path) // _ITEM_SIZE)
+            except FileNotFoundError:
+                sizes.append(0)
+        count = min(sizes)
+        for path, size in zip((ts_path, rate_path), sizes, strict=True):
+            if size != count or (os.path.exists(path) and os.path.getsize(path) % _ITEM_SIZE):
+                with open(path, "r+b") as f:
+                    f.truncate(count * _ITEM_SIZE)
+        return count
+
+    @staticmethod
+    def _last_timestamp(ts_path, count):
+        with open(ts_path, "rb") as f:
+            f.seek((count - 1) * _ITEM_SIZE)
+            return array('q', f.read(_ITEM_SIZE))[0]
+
+    # --- Чтение ---
+    def _columns(self, pair):
+        """Возвращает отображенные в память колонки пары (кэшируются до изменения размера файлов)."""
+        ts_path, rate_path = self._paths(pair)
+        try:
+            ts_stat, rate_stat = os.stat(ts_path), os.stat(rate_path)
+            size = min(ts_stat.st_size, rate_stat.st_size) // _ITEM_SIZE * _ITEM_SIZE
+            # Размер меняется при дописывании, inode — при пересборке (rebuild)
+            key = (size, ts_stat.st_ino, rate_stat.st_ino)
+        except FileNotFoundError:
+            size = 0
+            key = None
+
+        cached = self._maps.get(pair)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+
+        if size == 0:
+            columns = (self._empty(), self._empty())
+        else:
+            columns = tuple(self._map(path, size) for path in (ts_path, rate_path))
+        self._maps[pair] = (key, *columns)
+        return columns
+
+    @staticmethod
+    def _map(path, size):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        if np is not None:
+            return np.frombuffer(mapped, dtype=np.int64)
+        return memoryview(mapped).cast('q')
+
+    @staticmethod
+    def _empty():
+        if np is not None:
+            return np.empty(0, dtype=np.int64)
+        return memoryview(array('q'))
+
+    def range(self, pair, start=None, end=None):
+        """
+        Точки пары с start <= timestamp <= end (границы — ISO-строки, datetime
+        или микросекунды epoch). Возвращает (timestamps, rates) — срезы numpy
+        или memoryview поверх mmap, без копирования. Курс = rates[i] / RATE_SCALE.
+        """
+        timestamps, rates = self._columns(pair)
+        lo = 0 if start is None else self._search(timestamps, to_epoch_us(start), bisect_left)
+        hi = len(timestamps) if end is None else self._search(timestamps, to_epoch_us(end), bisect_right)
+        return timestamps[lo:hi], rates[lo:hi]
+
+    def rate_at(self, pair, at):
+        """
+        Курс, действовавший в момент at: последняя точка с timestamp <= at
+        (forward fill), бинарный поиск — O(log n). Возвращает
+        (микросекунды epoch точки, Decimal-курс) или None, если точек до at нет.
+        """
+        timestamps, rates = self._columns(pair)
+        i = self._search(timestamps, to_epoch_us(at), bisect_right)
+        if i == 0:
+            return None
+        return int(timestamps[i - 1]), from_fixed(rates[i - 1])
+
+    @staticmethod
+    def _search(timestamps, value, bisect_func):
+        if np is not None:
+            side = 'left' if bisect_func is bisect_left else 'right'
+            return int(np.searchsorted(timestamps, value, side=side))
+        return bisect_func(timestamps, value)
+
+
+history = ColumnarRateHistory()
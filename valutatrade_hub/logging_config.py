@@ -9,6 +9,19 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 LOGS_DIR = os.path.join(BASE_DIR, "logs")
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# Поля JSON-формата: записи без extra (служебные сообщения инфраструктуры) получают "N/A"
+_JSON_FIELDS = ("action", "username", "currency_code", "amount", "rate", "base", "result",
+                "error_type", "error_message")
+
+
+class _DefaultFieldsFilter(logging.Filter):
+    def filter(self, record):
+        for field in _JSON_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, "N/A")
+        return True
+
+
 def configure_logging():
     """Configures logging for the application"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -31,6 +44,9 @@ def configure_logging():
                 'datefmt': '%Y-%m-%dT%H:%M:%S%z'
             },
         },
+        'filters': {
+            'default_fields': {'()': _DefaultFieldsFilter},
+        },
         'handlers': {
             'console': {
                 'level': 'INFO',
@@ -46,6 +62,7 @@ def configure_logging():
                 'maxBytes': 1024 * 1024,
                 'backupCount': 5,
                 'encoding': 'utf8',
+                'filters': ['default_fields'],
             },
         },
         'loggers': {
@@ -1,91 +1,347 @@
 # valutatrade_hub/parser_service/api_clients.py
+import hashlib
+import importlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
 from decimal import Decimal
-from typing import Dict
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from ..core.exceptions import ApiRequestError
+from ..infra.locking import file_lock
 from .config import parser_config
+from .resilience import CircuitBreaker, TokenBucket, backoff_delay, parse_retry_after
+
+logger = logging.getLogger('valutatrade_hub.parser_service')
+
+
+class ResponseCache:
+    """
+    Валидаторы последнего ответа каждого провайдера (ETag, Last-Modified,
+    time_next_update) и полученные по нему курсы. Хранится в JSON-файле,
+    чтобы условные запросы работали и между запусками update-rates.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.file_path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, name) -> dict:
+        with self._lock:
+            return dict(self._load().get(name, {}))
+
+    def put(self, name, entry):
+        dir_path = os.path.dirname(self.file_path)
+        with self._lock:
+            os.makedirs(dir_path, exist_ok=True)
+            # Демон и разовый update-rates могут писать кеш одновременно: файл
+            # перечитывается под блокировкой, чтобы не затереть чужие записи
+            with file_lock(self.file_path, exclusive=True):
+                self._entries = None
+                entries = self._load()
+                entries[name] = entry
+                fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=f".{os.path.basename(self.file_path)}.",
+                                                suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump(entries, f, indent=4)
+                    os.replace(tmp_path, self.file_path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+                    raise
+
+
+response_cache = ResponseCache(parser_config.HTTP_CACHE_FILE_PATH)
+
+# NAME -> класс клиента; подклассы BaseApiClient регистрируются автоматически
+PROVIDER_CLASSES = {}
+
+
+def create_client(spec: str) -> "BaseApiClient":
+    """
+    Клиент провайдера из элемента ParserConfig.PROVIDERS: имя зарегистрированного
+    клиента ("coingecko") или путь к своему подклассу ("package.module:ClassName").
+    """
+    if ":" in spec:
+        module_name, class_name = spec.split(":", 1)
+        client_class = getattr(importlib.import_module(module_name), class_name)
+        if not (isinstance(client_class, type) and issubclass(client_class, BaseApiClient)):
+            raise ValueError(f"Provider '{spec}' is not a BaseApiClient subclass.")
+    else:
+        client_class = PROVIDER_CLASSES.get(spec)
+        if client_class is None:
+            raise ValueError(f"Unknown provider '{spec}'. Known providers: {', '.join(PROVIDER_CLASSES)}.")
+    return client_class()
 
 
 class BaseApiClient:
-    def fetch_rates(self) -> Dict[str, Decimal]:
-        raise NotImplementedError("Must be implemented by subclasses")
+    """
+    Общая часть клиентов: пул keep-alive соединений на весь процесс и условные
+    запросы. Если провайдер сообщил время следующего обновления и оно не
+    наступило, запрос не отправляется; если ответ 304 Not Modified — тело не
+    скачивается. В обоих случаях возвращаются курсы из последнего ответа.
 
+    Сетевые запросы идут через устойчивый слой: токен-бакет по квоте тарифа,
+    повторы с экспоненциальной паузой и джиттером (с учетом Retry-After) и
+    размыкатель цепи, который быстро пропускает отказавшего провайдера.
+    """
+    NAME = "base"
+    last_data_time = 0.0  # момент данных последнего fetch_rates у провайдера (epoch)
+
+    _session = None
+    _session_lock = threading.Lock()
+    _guards = {}  # NAME -> (TokenBucket, CircuitBreaker), общие для всех экземпляров клиента
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        PROVIDER_CLASSES[cls.NAME] = cls
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        """Одна сессия requests на все клиенты: соединения переиспользуются между запросами."""
+        with BaseApiClient._session_lock:
+            if BaseApiClient._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=parser_config.HTTP_POOL_SIZE,
+                                      pool_maxsize=parser_config.HTTP_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Accept-Encoding": "gzip, deflate", "User-Agent": "valutatrade-hub"})
+                BaseApiClient._session = session
+            return BaseApiClient._session
+
+    @classmethod
+    def guards(cls):
+        """Токен-бакет и размыкатель цепи провайдера (создаются один раз на процесс)."""
+        with BaseApiClient._session_lock:
+            guards = BaseApiClient._guards.get(cls.NAME)
+            if guards is None:
+                quota = parser_config.PROVIDER_QUOTAS.get(cls.NAME, {})
+                requests_allowed = quota.get("requests", 60)
+                bucket = TokenBucket(rate=requests_allowed / quota.get("per_seconds", 60),
+                                     capacity=quota.get("burst", requests_allowed))
+                breaker = CircuitBreaker(parser_config.CIRCUIT_FAILURE_THRESHOLD,
+                                         parser_config.CIRCUIT_RESET_SECONDS)
+                guards = BaseApiClient._guards[cls.NAME] = (bucket, breaker)
+            return guards
 
-class CoinGeckoClient(BaseApiClient):
     def fetch_rates(self) -> Dict[str, Decimal]:
-        config = parser_config
-        crypto_ids = ",".join(config.CRYPTO_ID_MAP[code] for code in config.CRYPTO_CURRENCIES)
+        url = self._url()
+        # Хеш URL вместо самого URL: в нем может быть API-ключ; смена списка валют сбрасывает кэш
+        url_hash = hashlib.blake2b(url.encode("utf-8"), digest_size=8).hexdigest()
+        cached = response_cache.get(self.NAME)
+        if cached.get('url_hash') != url_hash:
+            cached = {}
+        if cached.get('rates') is not None and time.time() < cached.get('next_update', 0):
+            self.last_data_time = cached.get('data_time', 0.0)
+            return self._cached_rates(cached)
 
-        url = f"{config.COINGECKO_URL}?ids={crypto_ids}&vs_currencies={config.BASE_FIAT_CURRENCY.lower()}"
+        bucket, breaker = self.guards()
+        if not breaker.allow():
+            raise ApiRequestError(f"{self.NAME}: provider is failing, skipped for another "
+                                  f"{breaker.retry_in():.0f}s (circuit open).", reason="circuit_open")
 
+        # Любой исход попытки отражается в размыкателе: иначе пробная попытка
+        # half-open осталась бы занятой навсегда
         try:
-            response = requests.get(url, timeout=config.REQUEST_TIMEOUT)
+            rates = self._request_with_retries(bucket, url, url_hash, cached)
+        except ApiRequestError as e:
+            if e.reason == "quota":
+                # Локальная квота — не сбой провайдера: цепь не размыкаем
+                breaker.release_trial()
+            else:
+                breaker.record_failure()
+            raise
+        except Exception as e:
+            # Неожиданный ответ (ошибка разбора данных, записи кэша и т.п.)
+            breaker.record_failure()
+            raise ApiRequestError(f"{self.NAME}: unexpected error: {e!r}", reason="unexpected") from e
+        breaker.record_success()
+        return rates
+
+    def _request_with_retries(self, bucket, url, url_hash, cached) -> Dict[str, Decimal]:
+        """Запрос с повторами временных сбоев в пределах RETRY_BUDGET_SECONDS и квоты провайдера."""
+        deadline = time.monotonic() + parser_config.RETRY_BUDGET_SECONDS
+        attempt = 0
+        while True:
+            if not bucket.acquire(max_wait=deadline - time.monotonic()):
+                raise ApiRequestError(f"{self.NAME}: request quota exhausted, try again later.", reason="quota")
+            try:
+                return self._request(url, url_hash, cached)
+            except ApiRequestError as e:
+                attempt += 1
+                delay = backoff_delay(attempt - 1, parser_config.RETRY_BASE_DELAY, parser_config.RETRY_MAX_DELAY,
+                                      e.retry_after)
+                if (not e.retryable or attempt >= parser_config.RETRY_ATTEMPTS
+                        or time.monotonic() + delay > deadline):
+                    raise
+                logger.warning(f"{self.NAME}: attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _request(self, url, url_hash, cached) -> Dict[str, Decimal]:
+        """Один условный GET к провайдеру."""
+        headers = {}
+        if cached.get('rates') is not None:
+            if cached.get('etag'):
+                headers["If-None-Match"] = cached['etag']
+            if cached.get('last_modified'):
+                headers["If-Modified-Since"] = cached['last_modified']
+
+        try:
+            response = self.session().get(url, headers=headers, timeout=parser_config.REQUEST_TIMEOUT)
+            if response.status_code == 304:
+                cached['next_update'] = self._next_update(response, None)
+                response_cache.put(self.NAME, cached)
+                self.last_data_time = cached.get('data_time', 0.0)
+                return self._cached_rates(cached)
             response.raise_for_status()
             data = response.json()
+        except requests.exceptions.HTTPError as e:
+            status_code = e.response.status_code
+            error = self._http_error(status_code, e)
+            # 429 и 5xx — временные сбои, их имеет смысл повторить
+            error.retryable = status_code == 429 or status_code >= 500
+            error.retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+            raise error from e
+        except requests.exceptions.RequestException as e:
+            raise ApiRequestError(f"{self.NAME}: network error: {e}", retryable=True) from e
+        except ValueError as e:
+            raise ApiRequestError(f"{self.NAME}: invalid JSON in response: {e}") from e
 
-            standardized_rates = {}
-            for code, coin_id in config.CRYPTO_ID_MAP.items():
-                pair_key = f"{code}_{config.BASE_FIAT_CURRENCY}"
-                if coin_id in data and config.BASE_FIAT_CURRENCY.lower() in data[coin_id]:
-                    rate = Decimal(str(data[coin_id][config.BASE_FIAT_CURRENCY.lower()]))
-                    standardized_rates[pair_key] = rate
+        rates = self._parse(data)
+        self.last_data_time = self._data_time(response, data)
+        response_cache.put(self.NAME, {
+            "url_hash": url_hash,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "next_update": self._next_update(response, data),
+            "data_time": self.last_data_time,
+            "rates": {pair: str(rate) for pair, rate in rates.items()},
+        })
+        return rates
 
-            return standardized_rates
+    @staticmethod
+    def _cached_rates(cached) -> Dict[str, Decimal]:
+        return {pair: Decimal(rate) for pair, rate in cached['rates'].items()}
 
-        except requests.exceptions.HTTPError as e:
-            # Handle HTTP errors
-            if e.response.status_code == 429:
-                raise ApiRequestError("CoinGecko is rate limiting us. Please try again later.")
-            else:
-                raise ApiRequestError(f"CoinGecko API request failed with status code {e.response.status_code}: {e}")
-        except requests.exceptions.HTTPError as e:
-            raise ApiRequestError(f"CoinGecko API error: {e}") from e
+    def _next_update(self, response, data) -> float:
+        """Момент (epoch), раньше которого данные провайдера не изменятся; по умолчанию — Expires."""
+        expires = response.headers.get("Expires")
+        if expires:
+            try:
+                return parsedate_to_datetime(expires).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return 0
+
+    def _data_time(self, response, data) -> float:
+        """Момент, к которому относятся курсы: Last-Modified или Date ответа."""
+        for header in ("Last-Modified", "Date"):
+            value = response.headers.get(header)
+            if value:
+                try:
+                    return parsedate_to_datetime(value).timestamp()
+                except (TypeError, ValueError):
+                    pass
+        return time.time()
+
+    def _url(self) -> str:
+        raise NotImplementedError("Must be implemented by subclasses")
+
+    def _parse(self, data) -> Dict[str, Decimal]:
+        raise NotImplementedError("Must be implemented by subclasses")
+
+    def _http_error(self, status_code, error) -> ApiRequestError:
+        if status_code == 429:
+            return ApiRequestError(f"{self.NAME} is rate limiting us. Please try again later.")
+        return ApiRequestError(f"{self.NAME} API request failed with status code {status_code}: {error}")
+
+
+class CoinGeckoClient(BaseApiClient):
+    NAME = "coingecko"
+
+    def _url(self) -> str:
+        config = parser_config
+        crypto_ids = ",".join(config.CRYPTO_ID_MAP[code] for code in config.CRYPTO_CURRENCIES)
+        return f"{config.COINGECKO_URL}?ids={crypto_ids}&vs_currencies={config.BASE_FIAT_CURRENCY.lower()}"
+
+    def _parse(self, data) -> Dict[str, Decimal]:
+        config = parser_config
+        standardized_rates = {}
+        for code, coin_id in config.CRYPTO_ID_MAP.items():
+            pair_key = f"{code}_{config.BASE_FIAT_CURRENCY}"
+            if coin_id in data and config.BASE_FIAT_CURRENCY.lower() in data[coin_id]:
+                rate = Decimal(str(data[coin_id][config.BASE_FIAT_CURRENCY.lower()]))
+                standardized_rates[pair_key] = rate
+        return standardized_rates
+
+    def _http_error(self, status_code, error) -> ApiRequestError:
+        if status_code == 429:
+            return ApiRequestError("CoinGecko is rate limiting us. Please try again later.")
+        return ApiRequestError(f"CoinGecko API request failed with status code {status_code}: {error}")
 
 
 class ExchangeRateApiClient(BaseApiClient):
-    def fetch_rates(self) -> Dict[str, Decimal]:
+    NAME = "exchangerate"
+
+    def _url(self) -> str:
         config = parser_config
         key = config.EXCHANGERATE_API_KEY
-        base = config.BASE_FIAT_CURRENCY
-
         if not key or key == "DEFAULT_KEY":
             raise ApiRequestError("API Key for ExchangeRate-API is missing or default.")
+        return f"{config.EXCHANGERATE_API_URL}/{key}/latest/{config.BASE_FIAT_CURRENCY}"
 
-        url = f"{config.EXCHANGERATE_API_URL}/{key}/latest/{base}"
+    def _parse(self, data) -> Dict[str, Decimal]:
+        if data.get("result") != "success":
+            error_type = data.get('error-type', 'Unknown')
+            if error_type == 'invalid-key':
+                raise ApiRequestError("Invalid API key for ExchangeRate-API.")
+            raise ApiRequestError(f"ExchangeRate-API returned failure: {error_type}")
 
-        try:
-            response = requests.get(url, timeout=config.REQUEST_TIMEOUT)
-            response.raise_for_status()  # Raises HTTPError for bad responses
-
-            data = response.json()
-
-            if data.get("result") != "success":
-                error_type = data.get('error-type', 'Unknown')
-                if error_type == 'invalid-key':
-                    raise ApiRequestError("Invalid API key for ExchangeRate-API.")
-                else:
-                    raise ApiRequestError(f"ExchangeRate-API returned failure: {error_type}")
+        standardized_rates = {}
+        for fiat_code, rate_str in data.get("conversion_rates", {}).items():
+            if fiat_code in parser_config.FIAT_CURRENCIES:
+                pair_key = f"{fiat_code}_USD"
+                rate = Decimal(str(rate_str))
+                standardized_rates[pair_key] = rate
+        return standardized_rates
 
-            standardized_rates = {}
-            for fiat_code, rate_str in data.get("conversion_rates", {}).items():
-                if fiat_code in config.FIAT_CURRENCIES:
-                    pair_key = f"{fiat_code}_USD"
-                    rate = Decimal(str(rate_str))
-                    standardized_rates[pair_key] = rate
+    def _next_update(self, response, data) -> float:
+        # ExchangeRate-API обновляет курсы по расписанию и сообщает время следующего обновления
+        next_update: Optional[int] = (data or {}).get("time_next_update_unix")
+        if next_update:
+            return float(next_update)
+        return super()._next_update(response, data)
 
-            return standardized_rates
+    def _data_time(self, response, data) -> float:
+        last_update: Optional[int] = (data or {}).get("time_last_update_unix")
+        if last_update:
+            return float(last_update)
+        return super()._data_time(response, data)
 
-        except requests.exceptions.HTTPError as e:
-            # Handle HTTP errors
-            if e.response.status_code == 401:
-                raise ApiRequestError("ExchangeRate-API: Authentication failed. Check your API key.")
-            elif e.response.status_code == 403:
-                raise ApiRequestError("ExchangeRate-API: You don't have permission to access this resource.")
-            elif e.response.status_code == 429:
-                raise ApiRequestError("ExchangeRate-API is rate limiting us. Please try again later.")
-            else:
-                raise ApiRequestError(f"ExchangeRate-API request failed with status code {e.response.status_code}: {e}")
-        except requests.exceptions.RequestException as e:
-            raise ApiRequestError(f"Network error: {e}") from e
+    def _http_error(self, status_code, error) -> ApiRequestError:
+        if status_code == 401:
+            return ApiRequestError("ExchangeRate-API: Authentication failed. Check your API key.")
+        if status_code == 403:
+            return ApiRequestError("ExchangeRate-API: You don't have permission to access this resource.")
+        if status_code == 429:
+            return ApiRequestError("ExchangeRate-API is rate limiting us. Please try again later.")
+        return ApiRequestError(f"ExchangeRate-API request failed with status code {status_code}: {error}")
@@ -35,12 +35,52 @@ class ParserConfig:
             "SOL": "solana",
         }
 
+        # Провайдеры в порядке приоритета: имя встроенного клиента или
+        # "package.module:ClassName" своего подкласса BaseApiClient. Опрашиваются параллельно
+        self.PROVIDERS: tuple = ("coingecko", "exchangerate")
+        # Курс пары из нескольких источников: "priority", "median" или "freshest"
+        self.MERGE_POLICY: str = "priority"
+        # Котировка дальше этой доли от медианы (при 3+ источниках) отбрасывается как выброс
+        self.OUTLIER_TOLERANCE: float = 0.05
+        # Минимум согласованных котировок, чтобы сохранить курс пары
+        self.MERGE_QUORUM: int = 1
+
         # Пути
         self.RATES_FILE_PATH: str = os.path.join(BASE_DIR, "data", "rates.json")
         self.HISTORY_FILE_PATH: str = os.path.join(BASE_DIR, "data", "exchange_rates.json")
+        # ETag/Last-Modified и курсы последнего ответа каждого провайдера
+        self.HTTP_CACHE_FILE_PATH: str = os.path.join(BASE_DIR, "data", "http_cache.json")
 
         # Сетевые параметры
         self.REQUEST_TIMEOUT: int = 10
+        self.HTTP_POOL_SIZE: int = 4  # keep-alive соединений на хост в общей сессии
+
+        # Повторы временных сбоев (сеть, 429, 5xx): экспоненциальная пауза с джиттером
+        self.RETRY_ATTEMPTS: int = 3
+        self.RETRY_BASE_DELAY: float = 0.5
+        self.RETRY_MAX_DELAY: float = 4.0
+        self.RETRY_BUDGET_SECONDS: float = 8.0  # все попытки укладываются в этот срок
+        # Размыкатель цепи: после N неудачных обновлений подряд провайдер пропускается
+        self.CIRCUIT_FAILURE_THRESHOLD: int = 3
+        self.CIRCUIT_RESET_SECONDS: float = 60.0
+        # Квоты тарифов: не больше requests запросов за per_seconds, burst — запас подряд
+        self.PROVIDER_QUOTAS: dict = {
+            "coingecko": {"requests": 30, "per_seconds": 60},
+            "exchangerate": {"requests": 1500, "per_seconds": 30 * 24 * 3600, "burst": 10},
+        }
+
+        # Общий срок одного обновления: провайдеры опрашиваются параллельно,
+        # не успевшие к сроку пропускаются
+        self.UPDATE_DEADLINE: float = 12.0
+
+        # rates-daemon: желаемый период обновления каждого провайдера, с.
+        # Фактический период не больше, чем позволяет rates_ttl_seconds (см. daemon.py)
+        self.DAEMON_INTERVALS: dict = {
+            "coingecko": 60,
+            "exchangerate": 3600,
+        }
+        self.DAEMON_JITTER: float = 0.1  # случайный разброс периода, доля от него
+        self.DAEMON_HEARTBEAT_PATH: str = os.path.join(BASE_DIR, "data", "rates_daemon.heartbeat.json")
 
 
 # Создаем экземпляр синглтона
@@ -0,0 +1,122 @@
+# valutatrade_hub/parser_service/daemon.py
+import heapq
+import json
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+from ..infra.settings import settings_loader
+from ..logging_config import configure_logging
+from .config import parser_config
+from .updater import updater
+
+logger = logging.getLogger('valutatrade_hub.parser_service')
+
+_LOG_EXTRA = {"action": "RATES_DAEMON", "username": "ParserService"}
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()[:19]
+
+
+class RatesDaemon:
+    """
+    Резидентный процесс обновления курсов вместо запуска update-rates из cron:
+    интерпретатор, импорты, пул соединений и файл логов создаются один раз.
+
+    У каждого провайдера свой период (DAEMON_INTERVALS) со случайным разбросом
+    DAEMON_JITTER, чтобы запросы не шли синхронно. Период ограничен сверху так,
+    чтобы даже самый поздний запуск вместе с UPDATE_DEADLINE завершался раньше,
+    чем курсы устареют по rates_ttl_seconds.
+    """
+
+    def __init__(self, heartbeat_path: str = None):
+        self.heartbeat_path = heartbeat_path or parser_config.DAEMON_HEARTBEAT_PATH
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._next_runs = {}  # провайдер -> время следующего запуска (epoch)
+        self._outcomes = {}  # провайдер -> итог его последнего обновления
+
+    def interval(self, name: str) -> float:
+        """Базовый период провайдера, согласованный с TTL курсов."""
+        ttl = settings_loader.get('rates_ttl_seconds', 300)
+        jitter = parser_config.DAEMON_JITTER
+        max_interval = (ttl - parser_config.UPDATE_DEADLINE) / (1 + jitter)
+        configured = parser_config.DAEMON_INTERVALS.get(name, ttl)
+        return max(1.0, min(configured, max_interval))
+
+    def _delay(self, name: str) -> float:
+        base = self.interval(name)
+        return base * random.uniform(1 - parser_config.DAEMON_JITTER, 1 + parser_config.DAEMON_JITTER)
+
+    def stop(self, signum=None, frame=None):
+        if not self._stop.is_set():
+            logger.info(f"Received signal {signum}, stopping after the current update.", extra=_LOG_EXTRA)
+        self._stop.set()
+
+    def write_heartbeat(self, status: str = "running"):
+        """Атомарно пишет файл-пульс: по его mtime и next_runs видно, что демон жив."""
+        heartbeat = {
+            "pid": os.getpid(),
+            "status": status,
+            "started_at": _iso(self.started_at),
+            "heartbeat_at": _iso(time.time()),
+            "next_runs": {name: _iso(due) for name, due in self._next_runs.items()},
+            "last_outcomes": self._outcomes,
+        }
+        os.makedirs(os.path.dirname(self.heartbeat_path), exist_ok=True)
+        tmp_path = f"{self.heartbeat_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(heartbeat, f, indent=4)
+        os.replace(tmp_path, self.heartbeat_path)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        names = updater.provider_names()
+        logger.info("Rates daemon started: " + ", ".join(f"{name} every ~{self.interval(name):.0f}s"
+                                                         for name in names), extra=_LOG_EXTRA)
+        # При старте все провайдеры опрашиваются сразу: курсы могли устареть, пока демон не работал
+        now = time.time()
+        schedule = [(now, name) for name in names]
+        heapq.heapify(schedule)
+        self._next_runs = dict((name, due) for due, name in schedule)
+
+        while not self._stop.is_set():
+            due, name = schedule[0]
+            # Пульс пишется и во время ожидания, не реже раза в TTL/10
+            wait = due - time.time()
+            if wait > 0:
+                self.write_heartbeat()
+                self._stop.wait(min(wait, max(1.0, settings_loader.get('rates_ttl_seconds', 300) / 10)))
+                continue
+
+            heapq.heappop(schedule)
+            try:
+                self._outcomes.update(updater.run_update(name))
+            except Exception as e:  # сбой одного обновления не должен останавливать демон
+                logger.error(f"Update of {name} failed: {e}",
+                             extra={**_LOG_EXTRA, "result": "ERROR", "error_type": type(e).__name__,
+                                    "error_message": str(e)})
+            # Следующий запуск отсчитывается от начала текущего, чтобы период не «уплывал»
+            next_due = max(due + self._delay(name), time.time())
+            heapq.heappush(schedule, (next_due, name))
+            self._next_runs[name] = next_due
+            self.write_heartbeat()
+
+        self.write_heartbeat(status="stopped")
+        logger.info("Rates daemon stopped.", extra=_LOG_EXTRA)
+
+
+def main():
+    configure_logging()
+    RatesDaemon().run()
+
+
+if __name__ == "__main__":
+    main()
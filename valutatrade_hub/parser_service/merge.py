@@ -0,0 +1,67 @@
+# valutatrade_hub/parser_service/merge.py
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional
+
+POLICIES = ("priority", "median", "freshest")
+
+
+class Quote(NamedTuple):
+    """Курс пары от одного провайдера; data_time — момент данных у провайдера (epoch)."""
+    provider: str
+    rate: Decimal
+    data_time: float
+
+
+class MergedRate(NamedTuple):
+    rate: Decimal
+    source: str
+    rejected: List[Quote]  # котировки, отброшенные как выбросы
+
+
+def _median(rates: List[Decimal]) -> Decimal:
+    rates = sorted(rates)
+    middle = len(rates) // 2
+    if len(rates) % 2:
+        return rates[middle]
+    return (rates[middle - 1] + rates[middle]) / 2
+
+
+def reject_outliers(quotes: List[Quote], tolerance: float):
+    """
+    Отбрасывает котировки, отличающиеся от медианы больше чем на tolerance (доля).
+    Из двух котировок нельзя понять, какая ошибочна, поэтому выбросы ищутся от трех.
+    """
+    if len(quotes) < 3:
+        return quotes, []
+    median = _median([quote.rate for quote in quotes])
+    limit = abs(median) * Decimal(str(tolerance))
+    kept = [quote for quote in quotes if abs(quote.rate - median) <= limit]
+    return kept, [quote for quote in quotes if abs(quote.rate - median) > limit]
+
+
+def merge_pair(quotes: List[Quote], policy: str, priority: Dict[str, int], tolerance: float,
+               quorum: int = 1) -> Optional[MergedRate]:
+    """
+    Итоговый курс пары по политике:
+      priority — курс первого по приоритету провайдера;
+      median   — медиана курсов (источник — все участвовавшие провайдеры);
+      freshest — курс с самыми свежими данными провайдера.
+    Возвращает None, если после отбраковки выбросов осталось меньше quorum котировок.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown merge policy '{policy}'. Use one of: {', '.join(POLICIES)}.")
+    kept, rejected = reject_outliers(quotes, tolerance)
+    if not kept or len(kept) < quorum:
+        return None
+    if len(kept) == 1:
+        return MergedRate(kept[0].rate, kept[0].provider, rejected)
+
+    if policy == "median":
+        providers = ",".join(sorted(quote.provider for quote in kept))
+        return MergedRate(_median([quote.rate for quote in kept]), f"median({providers})", rejected)
+    if policy == "freshest":
+        # При равной свежести побеждает провайдер с более высоким приоритетом
+        best = max(kept, key=lambda quote: (quote.data_time, -priority.get(quote.provider, len(priority))))
+    else:
+        best = min(kept, key=lambda quote: priority.get(quote.provider, len(priority)))
+    return MergedRate(best.rate, best.provider, rejected)
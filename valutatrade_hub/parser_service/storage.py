@@ -1,58 +1,68 @@
 # valutatrade_hub/parser_service/storage.py
 from datetime import datetime
 from decimal import Decimal
-from typing import Dict
+from typing import Dict, Union
 
+from ..infra.candles import candles
 from ..infra.database import database_manager  # Используем Singleton DB Manager
+from ..infra.timeseries import history
 
 
 class RateStorage:
-    def save_current_rates(self, rates_map: Dict[str, Decimal], source: str):
-        # print(rates_map)
+    def save_current_rates(self, rates_map: Dict[str, Decimal], source: Union[str, Dict[str, str]]):
         """
-        Обновляет rates.json (снимок) и добавляет запись в exchange_rates.json (история)
+        Обновляет rates.json (снимок) и дописывает записи в сегменты истории.
+        source — один источник для всех пар или словарь пара -> источник
         """
+        sources = source if isinstance(source, dict) else dict.fromkeys(rates_map, source)
         now_iso = datetime.utcnow().isoformat()
 
-        # 1. Обновление rates.json (Снимок)
-        current_rates_snapshot = database_manager.get_rates()
+        # 1. Обновление rates.json (Снимок) под блокировкой: параллельный
+        # update-rates не должен потерять пары, записанные другим процессом
+        with database_manager.locked('rates'):
+            current_rates_snapshot = database_manager.get_rates()
 
-        # Убеждаемся, что структура соответствует ТЗ
-        if 'pairs' not in current_rates_snapshot:
-            current_rates_snapshot['pairs'] = {}
+            # Убеждаемся, что структура соответствует ТЗ
+            if 'pairs' not in current_rates_snapshot:
+                current_rates_snapshot['pairs'] = {}
 
-        for pair_key, rate in rates_map.items():
-            # Обновляем запись в снимке
-            current_rates_snapshot['pairs'][pair_key] = {
-                "rate": str(rate),
-                "updated_at": now_iso,
-                "source": source
-            }
-
-        current_rates_snapshot["last_refresh"] = now_iso
-        database_manager.save_rates(current_rates_snapshot)
+            for pair_key, rate in rates_map.items():
+                # Обновляем запись в снимке
+                current_rates_snapshot['pairs'][pair_key] = {
+                    "rate": str(rate),
+                    "updated_at": now_iso,
+                    "source": sources.get(pair_key)
+                }
 
-        # 2. Обновление exchange_rates.json (История)
-        history = database_manager.get_exchange_rates_history()
-        if "history" not in history:
-            history["history"] = {}
+            current_rates_snapshot["last_refresh"] = now_iso
+            # Версия курсов — часть ключа кэша оценок портфелей
+            current_rates_snapshot["version"] = int(current_rates_snapshot.get("version", 0)) + 1
+            database_manager.save_rates(current_rates_snapshot)
 
+        # 2. История: дописываем только новые записи в текущий сегмент
+        records = []
         for pair_key, rate in rates_map.items():
             from_currency, to_currency = pair_key.split('_')
             # Формирование ID: <FROM><TO><ISO-UTC timestamp>
             record_id = f"{from_currency}{to_currency}_{now_iso}"
 
-            history["history"][record_id] = {
+            records.append({
                 "id": record_id,
                 "from_currency": from_currency,
                 "to_currency": to_currency,
                 "rate": str(rate),
                 "timestamp": now_iso,
-                "source": source,
+                "source": sources.get(pair_key),
                 "meta": {}
-            }
+            })
+
+        database_manager.append_exchange_rates_history(records)
+
+        # 3. Колоночная история (int64 timestamp + курс с фиксированной точкой) для аналитики
+        history.append_many(rates_map, now_iso)
 
-        database_manager.save_exchange_rates_history(history)
+        # 4. OHLC-свечи 1m/1h/1d обновляются инкрементально, без пересчета сырых тиков
+        candles.update(rates_map, now_iso)
         return len(rates_map)
 
 
@@ -1,11 +1,15 @@
 # valutatrade_hub/parser_service/updater.py
 import logging
-from datetime import datetime 
-from decimal import Decimal  
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from decimal import Decimal
 from typing import Dict, Optional
 
-from ..core.exceptions import ApiRequestError
-from .api_clients import CoinGeckoClient, ExchangeRateApiClient
+from ..infra.settings import settings_loader
+from .api_clients import create_client
+from .config import parser_config
+from .merge import Quote, merge_pair
 from .storage import storage
 
 # Инициализация логгера
@@ -16,10 +20,112 @@ class RatesUpdater:
     Класс для агрегации и обновления курсов валют из нескольких внешних API-источников
     """
     def __init__(self):
-        self.coingecko_client = CoinGeckoClient()
-        self.exchangerate_client = ExchangeRateApiClient()
-        # Храним, какой источник был последним, откуда мы успешно получили данные
-        self._SOURCE = "Combined"
+        # Реестр провайдеров из ParserConfig.PROVIDERS (в порядке приоритета)
+        self._clients = []
+        for spec in parser_config.PROVIDERS:
+            client = create_client(spec)
+            self._clients.append((client.NAME, client))
+        # Итог последнего обновления по провайдерам: статус, задержка, число курсов
+        self.last_outcomes = {}
+        # Источник курса каждой пары последнего обновления
+        self.last_sources = {}
+        # Последние котировки каждого провайдера: имя -> (время получения, {пара: Quote}).
+        # Демон опрашивает провайдеров по одному, и свежий курс сливается с этими котировками
+        self._last_quotes = {}
+
+    def _providers(self):
+        """Провайдеры в порядке приоритета."""
+        return self._clients
+
+    def provider_names(self):
+        return [name for name, _ in self._providers()]
+
+    @staticmethod
+    def _timed_fetch(client):
+        """Выполняется в потоке пула: (курсы, задержка в секундах, ошибка)."""
+        started = time.monotonic()
+        try:
+            rates = client.fetch_rates()
+            return rates, client.last_data_time, time.monotonic() - started, None
+        except Exception as e:  # ошибка одного провайдера не должна сорвать обновление
+            return None, None, time.monotonic() - started, e
+
+    def _record_outcome(self, name, latency, rates, error, base_log_extra, timed_out=False):
+        """Запоминает и логирует итог опроса одного провайдера."""
+        latency_ms = round(latency * 1000)
+        if timed_out:
+            outcome = {"status": "TIMEOUT", "latency_ms": latency_ms, "rates": 0,
+                       "error": f"No response within {parser_config.UPDATE_DEADLINE}s"}
+            msg = f"Fetching from {name}... TIMEOUT after {latency_ms} ms"
+            logger.error(msg, extra={**base_log_extra, "log_message": msg, "result": "ERROR",
+                                     "error_type": "Timeout", "error_message": outcome['error']})
+        elif error is not None:
+            outcome = {"status": "ERROR", "latency_ms": latency_ms, "rates": 0, "error": str(error)}
+            msg = f"Failed to fetch from {name} in {latency_ms} ms: {error}"
+            logger.error(msg, extra={**base_log_extra, "log_message": msg, "result": "ERROR",
+                                     "error_type": type(error).__name__, "error_message": str(error)})
+        else:
+            outcome = {"status": "OK", "latency_ms": latency_ms, "rates": len(rates), "error": None}
+            msg = f"Fetching from {name}... OK ({len(rates)} rates, {latency_ms} ms)"
+            logger.info(msg, extra={**base_log_extra, "log_message": msg, "result": "OK"})
+        self.last_outcomes[name] = outcome
+
+    def _quotes_to_merge(self, fresh):
+        """
+        Котировки для слияния: по каждой паре, полученной сейчас, — свежие
+        котировки плюс последние котировки остальных провайдеров, если они
+        получены не раньше чем rates_ttl_seconds назад. Так опрос по одному
+        провайдеру (rates-daemon) дает тот же курс, что и полное обновление.
+        """
+        now = time.time()
+        for name, provider_quotes in fresh.items():
+            self._last_quotes[name] = (now, provider_quotes)
+
+        max_age = settings_loader.get('rates_ttl_seconds', 300)
+        others = [provider_quotes for name, (received_at, provider_quotes) in self._last_quotes.items()
+                  if name not in fresh and now - received_at <= max_age]
+        quotes: Dict[str, list] = {}  # пара -> котировки провайдеров
+        for provider_quotes in fresh.values():
+            for pair_key, quote in provider_quotes.items():
+                quotes.setdefault(pair_key, []).append(quote)
+        for provider_quotes in others:
+            for pair_key, quote in provider_quotes.items():
+                if pair_key in quotes:
+                    quotes[pair_key].append(quote)
+        return quotes
+
+    def _fetch_all(self, providers, base_log_extra):
+        """
+        Опрашивает провайдеров параллельно в пределах UPDATE_DEADLINE.
+        Возвращает {провайдер: {пара: Quote}} успевших провайдеров; итог
+        каждого опроса записывается в last_outcomes.
+        """
+        fresh = {}
+        started = time.monotonic()
+        pool = ThreadPoolExecutor(max_workers=max(len(providers), 1), thread_name_prefix="rates-fetch")
+        futures = {pool.submit(self._timed_fetch, client): name for name, client in providers}
+        pending = set(futures)
+        try:
+            while pending:
+                remaining = parser_config.UPDATE_DEADLINE - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures[future]
+                    rates, data_time, latency, error = future.result()
+                    self._record_outcome(name, latency, rates, error, base_log_extra)
+                    if error is not None:
+                        continue
+                    fresh[name] = {pair_key: Quote(name, rate, data_time) for pair_key, rate in rates.items()}
+        finally:
+            # Не ждем зависших провайдеров: их потоки завершатся по REQUEST_TIMEOUT
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        for future in pending:
+            self._record_outcome(futures[future], time.monotonic() - started, None, None, base_log_extra,
+                                 timed_out=True)
+        return fresh
 
     def run_update(self, source_filter: Optional[str] = None):
         """
@@ -44,46 +150,42 @@ class RatesUpdater:
         logger.info("Starting rates update.", extra={**base_log_extra, "log_message":
                                                       "Starting rates update."})
 
-        # --- 1. Обработка CoinGecko ---
-        if source_filter is None or source_filter == "coingecko":
-            try:
-                cg_rates = self.coingecko_client.fetch_rates()
-                all_rates.update(cg_rates)
-                # Устанавливаем источник, если CoinGecko успешен
-                self._SOURCE = "coingecko" 
-                msg = f"Fetching from CoinGecko... OK ({len(cg_rates)} rates)"
-                logger.info(msg, extra={**base_log_extra, "log_message": msg, "result": "OK"})
-            except ApiRequestError as e:
-                msg = f"Failed to fetch from CoinGecko: {e}"
-                logger.error(msg, extra={**base_log_extra, "log_message": msg, "result":
-                                          "ERROR", "error_type": type(e).__name__, "error_message": str(e)})
-
-        # --- 2. Обработка ExchangeRate-API ---
-        if source_filter is None or source_filter == "exchangerate":
-            try:
-                er_rates = self.exchangerate_client.fetch_rates()
-                all_rates.update(er_rates)
-                # ВАЖНО: Использовать self._SOURCE для консистентности
-                self._SOURCE = "exchangerate" 
-                msg = f"Fetching from ExchangeRate-API... OK ({len(er_rates)} rates)"
-                logger.info(msg, extra={**base_log_extra, "log_message": msg, "result": "OK"})
-            except ApiRequestError as e:
-                msg = f"Failed to fetch from ExchangeRate-API: {e}"
-                logger.error(msg, extra={**base_log_extra, "log_message": msg, "result":
-                                          "ERROR", "error_type": type(e).__name__, "error_message": str(e)})
+        # --- 1. Параллельный опрос провайдеров с общим сроком ---
+        providers = [(name, client) for name, client in self._providers()
+                     if source_filter is None or source_filter == name]
+        self.last_outcomes = {}
+        fresh = self._fetch_all(providers, base_log_extra)
+        # --- 2. Курс каждой пары по политике слияния с отбраковкой выбросов ---
+        priority = {name: index for index, (name, _) in enumerate(self._providers())}
+        sources = {}
+        for pair_key, pair_quotes in self._quotes_to_merge(fresh).items():
+            merged = merge_pair(pair_quotes, parser_config.MERGE_POLICY, priority,
+                                parser_config.OUTLIER_TOLERANCE, parser_config.MERGE_QUORUM)
+            for quote in merged.rejected if merged else ():
+                msg = f"Rejected outlier {pair_key}={quote.rate} from {quote.provider}"
+                logger.warning(msg, extra={**base_log_extra, "log_message": msg, "rate": str(quote.rate),
+                                           "result": "OUTLIER"})
+            if merged is None:
+                msg = f"Skipped {pair_key}: fewer than {parser_config.MERGE_QUORUM} agreeing quotes"
+                logger.warning(msg, extra={**base_log_extra, "log_message": msg, "result": "NO_QUORUM"})
+                continue
+            all_rates[pair_key] = merged.rate
+            sources[pair_key] = merged.source
+        self.last_sources = sources
 
         # --- 3. Сохранение и вывод результата ---
         if all_rates:
-            # Сохранение в rates.json (предполагается, что storage импортирован)
-            updated_count = storage.save_current_rates(all_rates, source=self._SOURCE)
+            updated_count = storage.save_current_rates(all_rates, source=sources)
 
             # Формирование ответа для CLI
             if updated_count > 0:
-                print(f"Update successful. Total rates updated: {updated_count}. Last refresh: {datetime.utcnow().isoformat()[:19]}")
+                print(f"Update successful. Total rates updated: {updated_count}. "
+                      f"Last refresh: {datetime.utcnow().isoformat()[:19]}")
             else:
                 print("Update completed, but no new rates were saved.")
         else:
             print("Update failed: No rates were fetched from any source.")
+        return self.last_outcomes
 
 
 updater = RatesUpdater()